@@ -1,3 +1,219 @@
+import ipaddress
+
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .models import Bot, ChatSession, FastPathHit, Lead, Message
+
+# Filtered changelists count at most this many rows; unfiltered tables at
+# least this big use the database's row estimate instead of COUNT(*).
+COUNT_LIMIT = 10000
+
+TRANSCRIPT_PAGE_SIZE = 50
+TRANSCRIPT_PAGE_PARAM = "transcript_page"
+
+
+def estimated_rows(queryset):
+    """The planner's row estimate for the queryset's table, or None if unknown."""
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+            elif connection.vendor == "sqlite":
+                # Filled in by ANALYZE; first number of `stat` is the table's row count.
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+            else:
+                return None
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if not row or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    # Postgres reports -1 for a table that was never vacuumed/analyzed.
+    return estimate if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Changelist paginator that never runs a full COUNT(*) on a big table: the
+    unfiltered list uses the estimate, a filtered one counts up to COUNT_LIMIT.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_rows(queryset)
+            if estimate is not None and estimate >= COUNT_LIMIT:
+                return estimate
+        return queryset.order_by()[:COUNT_LIMIT].count()
+
+
+def parse_id(term):
+    return int(term) if term.isdigit() else None
+
+
+def parse_ip(term):
+    try:
+        return str(ipaddress.ip_address(term))
+    except ValueError:
+        return None
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Skips the second, unfiltered COUNT(*) behind "x results (y total)".
+    show_full_result_count = False
+    list_per_page = 50
+
+    # (parse, field) pairs: the search term is parsed into the field's own
+    # type and matched with `field=value`, so the lookup can use its index.
+    # (search_fields' `__exact` on a non-text column compiles to
+    # CAST(col AS text) = %s, a full table scan.) search_fields then only
+    # turns the search box on.
+    exact_search = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        if not self.exact_search:
+            return super().get_search_results(request, queryset, search_term)
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        matches = Q(pk__in=[])
+        for parse, field in self.exact_search:
+            value = parse(term)
+            if value is not None:
+                matches |= Q(**{field: value})
+        return queryset.filter(matches), False
+
+
+def transcript_page(request):
+    try:
+        return max(1, int(request.GET.get(TRANSCRIPT_PAGE_PARAM, 1)))
+    except ValueError:
+        return 1
+
+
+class TranscriptInline(admin.TabularInline):
+    """Read-only transcript on the session page, one page of messages at a time."""
+    model = Message
+    fields = ("created_at", "role", "text")
+    readonly_fields = fields
+    extra = 0
+    verbose_name_plural = "Transcript"
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        object_id = request.resolver_match.kwargs.get("object_id")
+        if object_id is None:
+            return queryset.none()
+        start = (transcript_page(request) - 1) * TRANSCRIPT_PAGE_SIZE
+        page_ids = (
+            Message.objects.filter(session_id=object_id)
+            .order_by("created_at", "id")
+            .values("id")[start:start + TRANSCRIPT_PAGE_SIZE]
+        )
+        return queryset.filter(id__in=page_ids).order_by("created_at", "id")
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ChatSession)
+class ChatSessionAdmin(LargeTableAdmin):
+    list_display = (
+        "id", "bot", "created_at", "country", "city",
+        "user_message_count", "bot_message_count", "lead_count",
+    )
+    list_select_related = ("bot",)
+    list_filter = ("bot", "created_at")
+    search_fields = ("id", "ip_address")
+    search_help_text = "Session id or IP address"
+    exact_search = ((parse_id, "pk"), (parse_ip, "ip_address"))
+    ordering = ("-id",)
+    raw_id_fields = ("bot",)
+    readonly_fields = (
+        "created_at", "updated_at", "first_message_at", "last_message_at", "turn_lease_until",
+        "user_message_count", "bot_message_count", "lead_count", "gated_lead_count",
+    )
+    inlines = [TranscriptInline]
+
+    def change_view(self, request, object_id, form_url="", extra_context=None):
+        extra_context = {**(extra_context or {}), "transcript_pager": self.transcript_pager(request, object_id)}
+        return super().change_view(request, object_id, form_url, extra_context)
+
+    def transcript_pager(self, request, object_id):
+        """Page links for TranscriptInline, sized from the session's counters (no COUNT)."""
+        counters = ChatSession.objects.filter(pk=object_id).values_list(
+            "user_message_count", "bot_message_count"
+        ).first()
+        if counters is None:
+            return None
+        total = sum(counters)
+        page = transcript_page(request)
+        pages = max(1, -(-total // TRANSCRIPT_PAGE_SIZE))
+        return {
+            "param": TRANSCRIPT_PAGE_PARAM,
+            "page": page,
+            "pages": pages,
+            "total": total,
+            "previous": page - 1 if page > 1 else None,
+            "next": page + 1 if page < pages else None,
+        }
+
+
+@admin.register(Message)
+class MessageAdmin(LargeTableAdmin):
+    list_display = ("id", "session", "role", "short_text", "created_at")
+    list_select_related = ("session",)
+    # Two values, so no index: the page is read in pk order and stops after
+    # list_per_page matches, and the count stops at COUNT_LIMIT.
+    list_filter = ("role",)
+    search_fields = ("session",)
+    search_help_text = "Session id"
+    exact_search = ((parse_id, "session_id"),)
+    ordering = ("-id",)
+    raw_id_fields = ("session",)
+
+    @admin.display(description="Text")
+    def short_text(self, obj):
+        return obj.text[:80]
+
+
+@admin.register(Lead)
+class LeadAdmin(LargeTableAdmin):
+    list_display = ("email", "name", "lead_type", "bot", "session", "created_at")
+    list_select_related = ("bot", "session")
+    # lead_type is low-cardinality and unindexed, like Message.role.
+    list_filter = ("lead_type", "bot", "created_at")
+    search_fields = ("email__exact",)  # text column: no CAST, uses its index
+    ordering = ("-id",)
+    raw_id_fields = ("session", "bot")
+
+
+@admin.register(Bot)
+class BotAdmin(admin.ModelAdmin):
+    list_display = ("name", "slug", "is_active", "lead_notification_email", "updated_at")
+    list_filter = ("is_active",)
+    search_fields = ("name", "slug")
+    prepopulated_fields = {"slug": ("name",)}
+
 
-# Register your models here.
+@admin.register(FastPathHit)
+class FastPathHitAdmin(admin.ModelAdmin):
+    list_display = ("rule", "bot_slug", "hits", "last_hit_at")
+    list_filter = ("bot_slug",)
+    ordering = ("-hits",)
+    readonly_fields = ("bot_slug", "rule", "hits", "last_hit_at")
@@ -0,0 +1,101 @@
+"""
+Deterministic fast-path answers.
+
+Messages like "pricing", "portfolio?" or "how do I contact you" have one
+correct answer, and it's fixed KB text, so paying seconds of OpenAI latency
+for them is wasted. A bot's fast-path rules look like:
+
+    {"name": "pricing", "keywords": ["pricing", "how much"],
+     "reply": "Pricing is scope-based ...", "lead": "contact"}
+    {"name": "portfolio", "keywords": ["portfolio", "your work"],
+     "reply": "Happy to share ...", "gated": ["Portfolio (PDF)"]}
+
+A rule fires when its keywords cover at least FAST_PATH_MIN_CONFIDENCE of the
+message's meaningful words (filler like "what's your" doesn't count), so
+"pricing please" is answered from the template while "pricing for a 40-SKU
+Shopify store with ads" still goes to the LLM. "lead" and "gated" are
+optional: "lead": "contact" forces the contact prompt even if the message
+has no contact keywords, and "gated" lists gated resources (by label) the
+reply always offers, behind the gated lead prompt.
+
+Hits are counted per (bot, rule) in FastPathHit.
+"""
+
+import re
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import FastPathHit
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+# Words that don't change what is being asked.
+FILLER_WORDS = frozenset("""
+    a an the and or of for to on in at with about is are am be it its this that
+    i i'm me my we our us you your you're do does can could would will may
+    what what's whats how where when which who please pls plz kindly
+    hi hello hey thanks thank ok okay so just some any more info details
+    tell share send show see get give know want need like looking
+""".split())
+
+
+class FastAnswer:
+    def __init__(self, rule, reply, extras):
+        self.rule = rule
+        self.reply = reply
+        self.extras = extras
+
+
+def compile_rules(entries):
+    """(name, matcher, entry) for each rule with at least one keyword."""
+    compiled = []
+    for entry in entries:
+        keywords = [kw.lower() for kw in entry.get("keywords", []) if kw]
+        if not keywords or not entry.get("reply"):
+            continue
+        # Longest first, so "how much" wins over "much".
+        keywords.sort(key=len, reverse=True)
+        matcher = re.compile(r"\b(?:" + "|".join(re.escape(kw) for kw in keywords) + r")\b")
+        compiled.append((entry["name"], matcher, entry))
+    return compiled
+
+
+def best_rule(rules, user_message):
+    """Return (confidence, entry) for the best-covering rule, or (0.0, None)."""
+    tokens = TOKEN_RE.findall(user_message.lower())
+    meaningful = [i for i, token in enumerate(tokens) if token not in FILLER_WORDS]
+    if not meaningful:
+        return 0.0, None
+
+    text = " ".join(tokens)
+    starts = []
+    offset = 0
+    for token in tokens:
+        starts.append(offset)
+        offset += len(token) + 1
+
+    best = (0.0, None)
+    for _, matcher, entry in rules:
+        covered = set()
+        for match in matcher.finditer(text):
+            covered.update(i for i, start in enumerate(starts) if match.start() <= start < match.end())
+        confidence = sum(1 for i in meaningful if i in covered) / len(meaningful)
+        if confidence > best[0]:
+            best = (confidence, entry)
+    return best
+
+
+def record_hit(bot, rule):
+    scope = bot.slug if bot is not None else "default"
+    now = timezone.now()
+    hits = FastPathHit.objects.filter(bot_slug=scope, rule=rule)
+    if hits.update(hits=F("hits") + 1, last_hit_at=now):
+        return
+    try:
+        with transaction.atomic():
+            FastPathHit.objects.create(bot_slug=scope, rule=rule, hits=1, last_hit_at=now)
+    except IntegrityError:
+        # Another worker created the row first.
+        hits.update(hits=F("hits") + 1, last_hit_at=now)
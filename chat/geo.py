@@ -0,0 +1,217 @@
+"""
+Offline IP -> (country, region, city) lookup.
+
+The dataset is compiled by `manage.py refresh_geo` into one binary file that
+we mmap and search with bisect, so a lookup is a few microseconds and never
+touches the network.
+
+File layout (integers are native-endian; the file is built on the host that reads it):
+
+    header   MAGIC (8 bytes) + n4, n6, locations_len (3 x uint64)
+    v4       starts[n4], ends[n4], loc[n4]                 (uint32 each)
+    v6       starts[n6], ends[n6]                          (16-byte big-endian keys)
+             loc[n6]                                       (uint32)
+    JSON     [[country, region, city], ...]                (indexed by loc)
+
+Ranges are sorted by start and non-overlapping.
+"""
+
+import ipaddress
+import json
+import mmap
+import os
+import struct
+import threading
+from array import array
+from bisect import bisect_right
+
+import requests
+from django.conf import settings
+
+from .countries import country_name
+
+MAGIC = b"DSGEO\x00\x01\x00"
+HEADER = struct.Struct("=8sQQQ")
+V6_WIDTH = 16
+
+
+def public_address(ip):
+    """
+    Parse `ip`, unwrapping IPv4-mapped IPv6. Returns None for garbage and for
+    anything that isn't globally routable (private, loopback, link-local,
+    CGNAT, reserved...).
+    """
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    if addr.version == 6 and addr.ipv4_mapped is not None:
+        addr = addr.ipv4_mapped
+    return addr if addr.is_global else None
+
+
+def ipapi_lookup(ip, timeout=2):
+    """
+    Online fallback via ipapi.co, used when no offline dataset is built.
+    Returns the location dict, or None if ipapi answered without one.
+    Network errors propagate.
+    """
+    resp = requests.get(f"https://ipapi.co/{ip}/json/", timeout=timeout)
+    if resp.status_code != 200:
+        return None
+    data = resp.json()
+    if data.get("error"):
+        return None
+    return {
+        "country": data.get("country_name") or "",
+        "region": data.get("region") or "",
+        "city": data.get("city") or "",
+    }
+
+
+class _FixedWidthKeys:
+    """
+    Sequence view over packed big-endian keys in the mmap, so bisect can search
+    them in place (big-endian bytes compare in numeric order).
+    """
+
+    def __init__(self, mm, offset, count, width):
+        self.mm = mm
+        self.offset = offset
+        self.count = count
+        self.width = width
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        start = self.offset + i * self.width
+        return self.mm[start:start + self.width]
+
+
+class GeoDB:
+    def __init__(self, path):
+        self.path = str(path)
+        with open(self.path, "rb") as f:
+            self.mtime = os.fstat(f.fileno()).st_mtime
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, n4, n6, locations_len = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a compiled geo dataset")
+
+        view = memoryview(self.mm)
+        offset = HEADER.size
+
+        def take(nbytes):
+            nonlocal offset
+            chunk = view[offset:offset + nbytes]
+            offset += nbytes
+            return chunk
+
+        def take_keys(count):
+            nonlocal offset
+            keys = _FixedWidthKeys(self.mm, offset, count, V6_WIDTH)
+            offset += count * V6_WIDTH
+            return keys
+
+        self.v4_starts = take(4 * n4).cast("I")
+        self.v4_ends = take(4 * n4).cast("I")
+        self.v4_loc = take(4 * n4).cast("I")
+        self.v6_starts = take_keys(n6)
+        self.v6_ends = take_keys(n6)
+        self.v6_loc = take(4 * n6).cast("I")
+        # Datasets compiled before codes were converted still hold "US", "IN"...
+        self.locations = [
+            [country_name(country), region, city]
+            for country, region, city in json.loads(bytes(take(locations_len)).decode("utf-8"))
+        ]
+
+    def lookup(self, ip):
+        """Return {"country", "region", "city"} for a public IP, else None."""
+        addr = public_address(ip)
+        if addr is None:
+            return None
+
+        if addr.version == 4:
+            key = int(addr)
+            starts, ends, locs = self.v4_starts, self.v4_ends, self.v4_loc
+        else:
+            key = addr.packed
+            starts, ends, locs = self.v6_starts, self.v6_ends, self.v6_loc
+
+        i = bisect_right(starts, key) - 1
+        if i < 0 or key > ends[i]:
+            return None
+        country, region, city = self.locations[locs[i]]
+        return {"country": country, "region": region, "city": city}
+
+
+def write_dataset(path, ranges):
+    """
+    Compile `ranges` -- an iterable of (start_ip, end_ip, country, region, city)
+    strings -- into the binary format above. Written atomically so running
+    workers never see a half-written file.
+    """
+    v4, v6 = [], []
+    location_ids = {}
+    locations = []
+
+    for start_ip, end_ip, country, region, city in ranges:
+        try:
+            start = ipaddress.ip_address(start_ip)
+            end = ipaddress.ip_address(end_ip)
+        except ValueError:
+            continue  # header rows, comments, junk
+        if start.version != end.version or int(end) < int(start):
+            continue
+        # DB-IP has ISO codes; store names like ipapi.co's country_name.
+        loc = (country_name(country or ""), region or "", city or "")
+        if loc not in location_ids:
+            location_ids[loc] = len(locations)
+            locations.append(list(loc))
+        (v4 if start.version == 4 else v6).append((int(start), int(end), location_ids[loc]))
+
+    v4.sort()
+    v6.sort()
+    locations_blob = json.dumps(locations, separators=(",", ":")).encode("utf-8")
+
+    tmp_path = f"{path}.tmp"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(v4), len(v6), len(locations_blob)))
+        for column in range(3):
+            f.write(array("I", (row[column] for row in v4)).tobytes())
+        for column in range(2):
+            f.write(b"".join(row[column].to_bytes(V6_WIDTH, "big") for row in v6))
+        f.write(array("I", (row[2] for row in v6)).tobytes())
+        f.write(locations_blob)
+    os.replace(tmp_path, path)
+
+    return len(v4), len(v6)
+
+
+_db = None
+_db_lock = threading.Lock()
+
+
+def get_geo_db():
+    """
+    Process-wide GeoDB, or None if no dataset has been built. Reopens the file
+    when `refresh_geo` replaces it, so workers pick up new data without a restart.
+    """
+    global _db
+    path = str(settings.GEOIP_DB_PATH)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+
+    db = _db
+    if db is not None and db.path == path and db.mtime == mtime:
+        return db
+
+    with _db_lock:
+        if _db is None or _db.path != path or _db.mtime != mtime:
+            _db = GeoDB(path)
+        return _db
@@ -0,0 +1,149 @@
+"""
+Optional Idempotency-Key support for the widget's POST endpoints.
+
+A client that may retry (network blips, double clicks) sends the same
+`Idempotency-Key: <uuid>` header on every attempt of one logical request:
+
+- the first attempt claims the key and runs the view as usual;
+- a later attempt gets the stored response back (with an
+  `Idempotent-Replayed: true` header) without touching the LLM or SMTP;
+- an attempt that arrives while the first is still running waits for it to
+  finish and then replays its response;
+- server errors and 409s are not stored, so a retry runs the view again.
+
+Keys live in the database (IdempotencyKey) so this works across gunicorn
+workers, and expire after IDEMPOTENCY_KEY_TTL seconds. A claim older than
+IDEMPOTENCY_LOCK_TIMEOUT is assumed to belong to a dead worker and is taken
+over. Requests without the header are not affected at all.
+"""
+
+import functools
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+# How often a duplicate re-checks whether the first request has finished.
+POLL_INTERVAL = 0.1
+
+
+def request_fingerprint(request):
+    payload = json.dumps(request.data, sort_keys=True, cls=JSONEncoder)
+    raw = f"{request.method} {request.get_full_path()}\n{payload}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def replay(record):
+    return Response(record.response, status=record.status_code, headers={REPLAYED_HEADER: "true"})
+
+
+def claim(scope, key, fingerprint):
+    """
+    Return (record, None) when this request should run the view, or
+    (None, response) when it must return `response` instead.
+    """
+    now = timezone.now()
+    IdempotencyKey.objects.filter(
+        created_at__lt=now - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    ).delete()
+
+    lock_timeout = timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+    deadline = time.monotonic() + settings.IDEMPOTENCY_LOCK_TIMEOUT
+
+    while True:
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    scope=scope, key=key, fingerprint=fingerprint, locked_at=timezone.now()
+                )
+            return record, None
+        except IntegrityError:
+            pass
+
+        try:
+            record = IdempotencyKey.objects.get(scope=scope, key=key)
+        except IdempotencyKey.DoesNotExist:
+            continue  # the holder gave up in the meantime; try to claim it again
+
+        if record.fingerprint != fingerprint:
+            return None, Response(
+                {"error": f"{HEADER} was already used for a different request"},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        if record.status_code is not None:
+            return None, replay(record)
+
+        now = timezone.now()
+        if record.locked_at < now - lock_timeout:
+            # The first attempt's worker died mid-request; take over its claim.
+            taken = IdempotencyKey.objects.filter(pk=record.pk, locked_at=record.locked_at).update(locked_at=now)
+            if taken:
+                record.locked_at = now
+                return record, None
+            continue
+
+        if time.monotonic() >= deadline:
+            return None, Response(
+                {"error": f"A request with this {HEADER} is still in progress"},
+                status=status.HTTP_409_CONFLICT,
+            )
+        time.sleep(POLL_INTERVAL)
+
+
+def idempotent(scope):
+    """
+    Decorator for DRF function views (place it below @api_view). `scope`
+    namespaces keys per endpoint.
+    """
+
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key:
+                return view_func(request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response(
+                    {"error": f"{HEADER} must be at most {MAX_KEY_LENGTH} characters"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            record, response = claim(scope, key, request_fingerprint(request))
+            if response is not None:
+                return response
+
+            try:
+                response = view_func(request, *args, **kwargs)
+            except Exception:
+                record.delete()
+                raise
+
+            if response.status_code >= 500 or response.status_code == status.HTTP_409_CONFLICT:
+                # Server errors and 409 (the session's previous turn is still
+                # being answered) are transient: let the client's retry run the
+                # view again instead of replaying them.
+                record.delete()
+                return response
+
+            # Round-trip through DRF's encoder so datetimes replay exactly as rendered.
+            record.response = json.loads(json.dumps(response.data, cls=JSONEncoder))
+            record.status_code = response.status_code
+            record.save(update_fields=["response", "status_code"])
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,109 @@
+"""
+Async reply jobs for overloaded periods.
+
+When OpenAI is slow, holding the POST open until the reply arrives means
+proxies/routers time the request out and the reply is lost even though it
+finishes later. A client that sends `Prefer: respond-async` lets the server
+answer 202 instead:
+
+    POST /api/chat/message/            -> 202 {"session_id", "job_id", "status": "pending", "poll_url"}
+    GET  /api/chat/jobs/<id>/?wait=20  -> {"job_id", "session_id", "status", "reply", links...}
+
+chat_message switches to jobs when this process already has
+CHAT_ASYNC_THRESHOLD OpenAI calls in flight. The LLM call runs on a small
+per-process thread pool; the result is stored on ReplyJob, so the poll can
+land on any worker or dyno.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import llm
+from .models import Message, ReplyJob
+from .turns import end_turn, release_turn
+
+LLM_ERROR_REPLY = "I ran into an issue fetching an answer. Please try again in a moment."
+
+# How often a long-poll re-reads the job.
+POLL_INTERVAL = 0.25
+
+# Finished jobs are only polled for a few seconds; keep a day for debugging.
+JOB_RETENTION = timedelta(days=1)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    """The process's job pool, created on first use (i.e. after gunicorn forks)."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.CHAT_JOB_WORKERS,
+                thread_name_prefix="reply-job",
+            )
+        return _executor
+
+
+def wants_async(request):
+    """Client accepts 202 + polling, and this process is busy enough to need it."""
+    prefer = request.headers.get("Prefer", "")
+    if "respond-async" not in prefer.lower():
+        return False
+    return llm.in_flight() >= settings.CHAT_ASYNC_THRESHOLD
+
+
+def enqueue(session, history, cache_key, extras, lease):
+    """Start the turn's LLM call in the background; the job releases the turn lease."""
+    ReplyJob.objects.filter(created_at__lt=timezone.now() - JOB_RETENTION).delete()
+    job = ReplyJob.objects.create(session=session, extras=extras)
+    executor().submit(run_job, job.pk, session.pk, history, cache_key, lease)
+    return job
+
+
+def run_job(job_id, session_id, history, cache_key, lease):
+    """Pool thread: ask OpenAI, store the bot message and finish the job."""
+    try:
+        try:
+            completion = llm.complete(history, cache_key=cache_key)
+            bot_reply, usage = completion.text, completion.usage
+        except Exception as e:
+            print("OpenAI error:", e)
+            bot_reply, usage = LLM_ERROR_REPLY, {}
+
+        job = ReplyJob.objects.get(pk=job_id)
+        Message.objects.create(session_id=session_id, role="assistant", text=bot_reply, **usage)
+        end_turn(session_id, lease)
+        lease = None
+        job.reply = bot_reply
+        job.status = "done"
+        job.finished_at = timezone.now()
+        job.save(update_fields=["reply", "status", "finished_at"])
+    except Exception as e:
+        print("Reply job error:", e)
+        ReplyJob.objects.filter(pk=job_id).update(status="failed", finished_at=timezone.now())
+    finally:
+        # No bot message was stored: give the lease back without counting one.
+        if lease is not None:
+            try:
+                release_turn(session_id, lease)
+            except Exception as e:
+                print("Reply job error:", e)
+        # Pool threads outlive requests, so nothing else closes their connections.
+        close_old_connections()
+
+
+def job_state(job):
+    """Job status as the poll endpoint reports it (stale pending jobs count as failed)."""
+    if job.status == "pending":
+        # The worker running it was killed/restarted before it finished.
+        stale_after = timedelta(seconds=settings.LLM_DEADLINE + 10)
+        if job.created_at < timezone.now() - stale_after:
+            return "failed"
+    return job.status
@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from openai import AsyncOpenAI, OpenAI
+
+client = OpenAI(
+    api_key=settings.OPENAI_API_KEY,
+    timeout=settings.OPENAI_TIMEOUT,
+    max_retries=settings.OPENAI_MAX_RETRIES,
+)
+
+# Used by the WebSocket transport, which streams tokens from inside the event loop.
+async_client = AsyncOpenAI(
+    api_key=settings.OPENAI_API_KEY,
+    timeout=settings.OPENAI_TIMEOUT,
+    max_retries=settings.OPENAI_MAX_RETRIES,
+)
+
+STUB_REPLY = "This is a stubbed reply (OPENAI_STUB_DELAY is set)."
+
+# Provider prefix caching: prompts under CACHE_MIN_TOKENS are never cached and
+# hits are counted in CACHE_BLOCK_TOKENS steps. The stub mimics this.
+CACHE_MIN_TOKENS = 1024
+CACHE_BLOCK_TOKENS = 128
+
+# complete() calls currently waiting on OpenAI in this process; chat_message
+# switches to async jobs above CHAT_ASYNC_THRESHOLD.
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+
+def in_flight():
+    return _in_flight
+
+
+class Completion:
+    """One LLM reply plus its token usage (usage is None where the provider didn't report it)."""
+
+    def __init__(self, text, prompt_tokens=None, cached_tokens=None, completion_tokens=None, llm_ms=None):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.cached_tokens = cached_tokens
+        self.completion_tokens = completion_tokens
+        self.llm_ms = llm_ms
+
+    @property
+    def usage(self):
+        """Fields to store on the assistant Message."""
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "llm_ms": self.llm_ms,
+        }
+
+
+def read_usage(usage):
+    """(prompt, cached, completion) tokens from an OpenAI usage object."""
+    if usage is None:
+        return None, None, None
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    return usage.prompt_tokens, cached or 0, usage.completion_tokens
+
+
+def complete(messages, cache_key=None):
+    """
+    Run one chat completion and return a Completion.
+
+    cache_key (see BotProfile.cache_key) routes requests sharing a prompt
+    prefix to the same provider cache. Raises whatever the OpenAI client
+    raises (timeouts included); callers decide how to degrade.
+    """
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight += 1
+    started = time.perf_counter()
+    try:
+        reply = _complete(messages, cache_key)
+    finally:
+        with _in_flight_lock:
+            _in_flight -= 1
+    reply.llm_ms = round((time.perf_counter() - started) * 1000)
+    return reply
+
+
+def _complete(messages, cache_key):
+    if settings.OPENAI_STUB_DELAY is not None:
+        prompt_tokens, cached_tokens = stub_cache.lookup(messages)
+        time.sleep(stub_cache.delay(prompt_tokens, cached_tokens))
+        return Completion(STUB_REPLY, prompt_tokens, cached_tokens, len(STUB_REPLY) // 4)
+
+    options = {"prompt_cache_key": cache_key} if cache_key else {}
+    completion = client.chat.completions.create(
+        model=settings.OPENAI_MODEL,
+        messages=messages,
+        **options,
+    )
+    return Completion(completion.choices[0].message.content, *read_usage(completion.usage))
+
+
+async def astream(messages, cache_key=None, usage=None):
+    """
+    Async generator yielding reply text chunks as the model produces them.
+    If a `usage` dict is passed it is filled with the Completion.usage fields
+    once the stream ends.
+    """
+    started = time.perf_counter()
+    if settings.OPENAI_STUB_DELAY is not None:
+        prompt_tokens, cached_tokens = stub_cache.lookup(messages)
+        await asyncio.sleep(stub_cache.delay(prompt_tokens, cached_tokens))
+        for word in STUB_REPLY.split(" "):
+            yield word + " "
+        counts = (prompt_tokens, cached_tokens, len(STUB_REPLY) // 4)
+    else:
+        options = {"prompt_cache_key": cache_key} if cache_key else {}
+        stream = await async_client.chat.completions.create(
+            model=settings.OPENAI_MODEL,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **options,
+        )
+        counts = (None, None, None)
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if chunk.usage is not None:
+                counts = read_usage(chunk.usage)
+
+    if usage is not None:
+        llm_ms = round((time.perf_counter() - started) * 1000)
+        usage.update(Completion(None, *counts, llm_ms=llm_ms).usage)
+
+
+class StubPromptCache:
+    """
+    Local stand-in for the provider's prefix cache, so OPENAI_STUB_DELAY runs
+    show what a prompt layout does to hit rate and latency.
+
+    Tokens are estimated at ~4 characters each. A prompt is cached up to the
+    longest message boundary this process has already seen, in provider-style
+    blocks. The stub delay is treated as half prefill (skipped for cached
+    tokens) and half generation.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.prefixes = OrderedDict()
+        self.lock = threading.Lock()
+
+    def lookup(self, messages):
+        digest = hashlib.sha256()
+        tokens = 0
+        boundaries = []
+        for message in messages:
+            digest.update(json.dumps(message, sort_keys=True).encode())
+            tokens += len(message["content"]) // 4 + 4
+            boundaries.append((digest.hexdigest(), tokens))
+
+        cached = 0
+        with self.lock:
+            for key, prefix_tokens in boundaries:
+                if key in self.prefixes:
+                    self.prefixes.move_to_end(key)
+                    cached = prefix_tokens
+                else:
+                    self.prefixes[key] = True
+            while len(self.prefixes) > self.maxsize:
+                self.prefixes.popitem(last=False)
+
+        if cached < CACHE_MIN_TOKENS:
+            cached = 0
+        return tokens, cached // CACHE_BLOCK_TOKENS * CACHE_BLOCK_TOKENS
+
+    def delay(self, prompt_tokens, cached_tokens):
+        base = float(settings.OPENAI_STUB_DELAY)
+        uncached = (prompt_tokens - cached_tokens) / prompt_tokens if prompt_tokens else 1
+        return base * (0.5 + 0.5 * uncached)
+
+
+stub_cache = StubPromptCache()
@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chat.geo import get_geo_db, ipapi_lookup, public_address
+from chat.models import ChatSession
+
+GEO_FIELDS = ["country", "region", "city"]
+
+
+class RateLimiter:
+    """At most `rate` calls per second across all threads (evenly spaced)."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_at, now)
+            self.next_at = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill in country/region/city for sessions whose geo lookup failed. "
+        "Sessions are read in id order, deduped by IP, each IP is resolved once "
+        "(offline dataset if built, else ipapi.co through a rate-limited thread "
+        "pool) and results are written back one transaction per chunk, so an "
+        "interrupted run can simply be started again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Sessions read and written per chunk.")
+        parser.add_argument("--workers", type=int, default=4, help="Concurrent ipapi.co lookups.")
+        parser.add_argument("--rate", type=float, default=1.0, help="Max ipapi.co requests per second (0 = unlimited).")
+        parser.add_argument("--after-id", type=int, default=0, help="Resume after this session id.")
+        parser.add_argument("--online", action="store_true", help="Use ipapi.co even if the offline dataset exists.")
+
+    def handle(self, *args, **opts):
+        geo_db = None if opts["online"] else get_geo_db()
+        if geo_db is not None:
+            self.stdout.write("Resolving with the offline geo dataset.")
+            pool = None
+        else:
+            self.stdout.write(f"Resolving with ipapi.co ({opts['workers']} workers, {opts['rate']}/s).")
+            pool = ThreadPoolExecutor(max_workers=opts["workers"])
+            self.limiter = RateLimiter(opts["rate"])
+
+        missing = ChatSession.objects.filter(ip_address__isnull=False, country="").order_by("id")
+        resolved = {}  # ip -> location or None, shared across chunks
+        cursor = opts["after_id"]
+        scanned = updated = 0
+        started = time.perf_counter()
+
+        try:
+            while True:
+                chunk = list(missing.filter(id__gt=cursor).values_list("id", "ip_address")[:opts["chunk_size"]])
+                if not chunk:
+                    break
+
+                sessions_by_ip = defaultdict(list)
+                for session_id, ip in chunk:
+                    sessions_by_ip[ip].append(session_id)
+                new_ips = [ip for ip in sessions_by_ip if ip not in resolved and public_address(ip) is not None]
+                lookup = geo_db.lookup if geo_db is not None else self.lookup_online
+                results = map(lookup, new_ips) if pool is None else pool.map(lookup, new_ips)
+                resolved.update(zip(new_ips, results))
+
+                # Sessions sharing a location get one UPDATE ... WHERE id IN (...).
+                sessions_by_location = defaultdict(list)
+                for ip, session_ids in sessions_by_ip.items():
+                    location = resolved.get(ip)
+                    if location and location["country"]:
+                        sessions_by_location[tuple(location[f] for f in GEO_FIELDS)].extend(session_ids)
+                with transaction.atomic():
+                    for values, session_ids in sessions_by_location.items():
+                        ChatSession.objects.filter(id__in=session_ids).update(**dict(zip(GEO_FIELDS, values)))
+                        updated += len(session_ids)
+
+                cursor = chunk[-1][0]
+                scanned += len(chunk)
+                self.stdout.write(
+                    f"  up to session {cursor}: {scanned} scanned, {updated} updated, {len(resolved)} unique IPs"
+                )
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING(f"Interrupted; resume with --after-id {cursor}"))
+            raise
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Backfilled {updated} of {scanned} sessions ({len(resolved)} unique IPs) "
+                f"in {time.perf_counter() - started:.1f}s"
+            )
+        )
+
+    def lookup_online(self, ip):
+        self.limiter.wait()
+        try:
+            return ipapi_lookup(ip, timeout=5)
+        except Exception as e:
+            print("Geo lookup error:", ip, e)
+            return None
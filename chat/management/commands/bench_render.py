@@ -0,0 +1,72 @@
+import timeit
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from chat.renderers import FastJSONRenderer, orjson
+from chat.views import DEFAULT_BOT_PROFILE
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark chat/stats response rendering: stock vs fast renderer, v1 vs v2 schema."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=40, help="Transcript length for the chat payload.")
+        parser.add_argument("--countries", type=int, default=60)
+        parser.add_argument("--number", type=int, default=2000)
+
+    def handle(self, *args, **opts):
+        payloads = self.build_payloads(opts["messages"], opts["countries"])
+        renderers = [("JSONRenderer", JSONRenderer()), ("FastJSONRenderer", FastJSONRenderer())]
+
+        if orjson is None:
+            self.stdout.write("orjson not installed: FastJSONRenderer is using the stdlib fallback.")
+
+        self.stdout.write(f"{'payload':<10} {'renderer':<18} {'us/render':>10} {'bytes':>8}")
+        for name, data in payloads:
+            for renderer_name, renderer in renderers:
+                seconds = timeit.timeit(lambda: renderer.render(data), number=opts["number"])
+                size = len(renderer.render(data))
+                self.stdout.write(
+                    f"{name:<10} {renderer_name:<18} {seconds / opts['number'] * 1e6:>10.1f} {size:>8}"
+                )
+
+    def build_payloads(self, n_messages, n_countries):
+        now = timezone.now()
+        user_message = "Can you share your portfolio and pricing for Shopify webstores?"
+        reply = "Sure! Our Webstore Design service covers Shopify, WordPress and Instapages. " * 3
+        extras = DEFAULT_BOT_PROFILE.reply_extras(user_message)
+
+        chat_v1 = {
+            "session_id": 1234,
+            "messages": [
+                {
+                    "role": "user" if i % 2 == 0 else "assistant",
+                    "text": user_message if i % 2 == 0 else reply,
+                    "created_at": now - timedelta(seconds=n_messages - i),
+                }
+                for i in range(n_messages)
+            ],
+            **extras,
+        }
+        chat_v2 = {"session_id": 1234, "reply": reply, **extras}
+
+        countries = [(f"Country {i}", 1000 - i) for i in range(n_countries)]
+        totals = {
+            "total_sessions": 52000,
+            "total_leads": 1400,
+            "total_gated_leads": 320,
+            "total_user_messages": 210000,
+            "total_bot_messages": 209000,
+        }
+        stats_v1 = {**totals, "sessions_by_country": [{"country": c, "count": n} for c, n in countries]}
+        stats_v2 = {**totals, "sessions_by_country": [[c, n] for c, n in countries]}
+
+        return [
+            ("chat v1", chat_v1),
+            ("chat v2", chat_v2),
+            ("stats v1", stats_v1),
+            ("stats v2", stats_v2),
+        ]
@@ -0,0 +1,70 @@
+import json
+import statistics
+import time
+
+import requests
+from django.core.management.base import BaseCommand
+from websockets.sync.client import connect
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare per-message latency of the HTTP chat endpoint against the "
+        "WebSocket transport. Run against an ASGI server started with "
+        "OPENAI_STUB_DELAY=0 so only transport/server overhead is measured."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+        parser.add_argument("--messages", type=int, default=50)
+        parser.add_argument("--origin", default="http://127.0.0.1:8000")
+
+    def handle(self, *args, **opts):
+        base_url = opts["base_url"].rstrip("/")
+        n = opts["messages"]
+
+        http_times = self.bench_http(base_url, n, opts["origin"])
+        ws_times = self.bench_ws(base_url, n, opts["origin"])
+
+        for label, times in (("http", http_times), ("websocket", ws_times)):
+            self.stdout.write(
+                f"{label:<10} mean {statistics.mean(times) * 1000:7.2f}ms  "
+                f"p50 {statistics.median(times) * 1000:7.2f}ms  "
+                f"max {max(times) * 1000:7.2f}ms  ({len(times)} msgs, one session)"
+            )
+
+    def bench_http(self, base_url, n, origin):
+        """What the widget does today: preflight + POST per message."""
+        url = base_url + "/api/chat/message/"
+        http = requests.Session()
+        session_id = None
+        times = []
+        for i in range(n):
+            payload = {"message": f"benchmark message {i}"}
+            if session_id:
+                payload["session_id"] = session_id
+            start = time.perf_counter()
+            http.options(
+                url,
+                headers={
+                    "Origin": origin,
+                    "Access-Control-Request-Method": "POST",
+                    "Access-Control-Request-Headers": "content-type",
+                },
+            )
+            resp = http.post(url, json=payload, headers={"Origin": origin})
+            times.append(time.perf_counter() - start)
+            session_id = resp.json()["session_id"]
+        return times
+
+    def bench_ws(self, base_url, n, origin):
+        url = base_url.replace("http", "ws", 1) + "/ws/chat/"
+        times = []
+        with connect(url, origin=origin) as ws:
+            for i in range(n):
+                start = time.perf_counter()
+                ws.send(json.dumps({"message": f"benchmark message {i}"}))
+                while json.loads(ws.recv())["type"] != "reply":
+                    pass
+                times.append(time.perf_counter() - start)
+        return times
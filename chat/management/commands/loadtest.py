@@ -0,0 +1,48 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire concurrent chat turns at a running server and report throughput. "
+        "Start the server with OPENAI_STUB_DELAY set so results measure serving "
+        "concurrency, not OpenAI."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000/api/chat/message/")
+        parser.add_argument("--requests", type=int, default=64)
+        parser.add_argument("--concurrency", type=int, default=32)
+        parser.add_argument("--message", default="What does Dotswitch do?")
+
+    def handle(self, *args, **opts):
+        url = opts["url"]
+        payload = {"message": opts["message"]}
+
+        def one_turn(_):
+            start = time.perf_counter()
+            try:
+                resp = requests.post(url, json=payload, timeout=120)
+                ok = resp.status_code == 200
+            except requests.RequestException:
+                ok = False
+            return ok, time.perf_counter() - start
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=opts["concurrency"]) as pool:
+            results = list(pool.map(one_turn, range(opts["requests"])))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(lat for _, lat in results)
+        failures = sum(1 for ok, _ in results if not ok)
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+        self.stdout.write(f"requests:    {len(results)} ({failures} failed)")
+        self.stdout.write(f"concurrency: {opts['concurrency']}")
+        self.stdout.write(f"wall time:   {elapsed:.2f}s")
+        self.stdout.write(f"throughput:  {len(results) / elapsed:.1f} req/s")
+        self.stdout.write(f"latency p50: {p50 * 1000:.0f}ms  p95: {p95 * 1000:.0f}ms")
@@ -0,0 +1,56 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Avg, Count, Q, Sum
+from django.utils import timezone
+
+from chat.models import Message
+from chat.routers import use_analytics_db
+
+
+class Command(BaseCommand):
+    help = (
+        "Prompt-cache hit rate, latency and estimated input-cost savings from "
+        "the token usage recorded on assistant messages."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=7)
+        parser.add_argument(
+            "--cached-discount",
+            type=float,
+            default=0.9,
+            help="Fraction of the input price saved on a cached token (model-specific).",
+        )
+
+    def handle(self, *args, **opts):
+        since = timezone.now() - timedelta(days=opts["days"])
+        hit = Q(cached_tokens__gt=0)
+        with use_analytics_db():
+            stats = Message.objects.filter(
+                role="assistant", prompt_tokens__isnull=False, created_at__gte=since
+            ).aggregate(
+                turns=Count("id"),
+                hits=Count("id", filter=hit),
+                prompt=Sum("prompt_tokens"),
+                cached=Sum("cached_tokens"),
+                hit_ms=Avg("llm_ms", filter=hit),
+                miss_ms=Avg("llm_ms", filter=~hit),
+            )
+
+        if not stats["turns"]:
+            self.stdout.write(f"No LLM turns with usage in the last {opts['days']} days.")
+            return
+
+        prompt, cached = stats["prompt"] or 0, stats["cached"] or 0
+        rate = cached / prompt if prompt else 0
+        self.stdout.write(f"LLM turns (last {opts['days']} days): {stats['turns']}, {stats['hits']} with a cache hit")
+        self.stdout.write(f"Prompt tokens: {prompt}, cached: {cached} ({rate:.1%})")
+        if stats["hit_ms"] is not None or stats["miss_ms"] is not None:
+            self.stdout.write(
+                f"Avg LLM latency: {self.ms(stats['hit_ms'])} on hits, {self.ms(stats['miss_ms'])} on misses"
+            )
+        self.stdout.write(f"Est. input cost saved: {rate * opts['cached_discount']:.1%}")
+
+    def ms(self, value):
+        return "-" if value is None else f"{value:.0f}ms"
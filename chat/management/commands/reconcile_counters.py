@@ -0,0 +1,146 @@
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max, Min
+
+from chat.models import ChatSession
+
+# Per-session truth recomputed from chat_message / chat_lead for one id range.
+AGGREGATE = """
+    SELECT cs.id,
+           COALESCE(m.user_count, 0) AS user_count,
+           COALESCE(m.bot_count, 0) AS bot_count,
+           COALESCE(l.lead_count, 0) AS lead_count,
+           COALESCE(l.gated_count, 0) AS gated_count,
+           m.first_at,
+           m.last_at
+    FROM chat_chatsession cs
+    LEFT JOIN (
+        SELECT session_id,
+               SUM(CASE WHEN role = 'user' THEN 1 ELSE 0 END) AS user_count,
+               SUM(CASE WHEN role = 'assistant' THEN 1 ELSE 0 END) AS bot_count,
+               -- first/last_message_at track the user's messages (see chat/turns.py)
+               MIN(CASE WHEN role = 'user' THEN created_at END) AS first_at,
+               MAX(CASE WHEN role = 'user' THEN created_at END) AS last_at
+        FROM chat_message
+        WHERE session_id >= %s AND session_id < %s
+        GROUP BY session_id
+    ) m ON m.session_id = cs.id
+    LEFT JOIN (
+        SELECT session_id,
+               COUNT(*) AS lead_count,
+               SUM(CASE WHEN lead_type = 'gated_info' THEN 1 ELSE 0 END) AS gated_count
+        FROM chat_lead
+        WHERE session_id >= %s AND session_id < %s
+        GROUP BY session_id
+    ) l ON l.session_id = cs.id
+    WHERE cs.id >= %s AND cs.id < %s {scope}
+"""
+
+# Only rows that actually differ are touched, so the rowcount is "corrected".
+DRIFTED = """
+    s.user_message_count <> agg.user_count
+    OR s.bot_message_count <> agg.bot_count
+    OR s.lead_count <> agg.lead_count
+    OR s.gated_lead_count <> agg.gated_count
+    OR s.first_message_at {distinct} agg.first_at
+    OR s.last_message_at {distinct} agg.last_at
+"""
+
+UPDATE = """
+    UPDATE chat_chatsession AS s
+    SET user_message_count = agg.user_count,
+        bot_message_count = agg.bot_count,
+        lead_count = agg.lead_count,
+        gated_lead_count = agg.gated_count,
+        first_message_at = agg.first_at,
+        last_message_at = agg.last_at
+    FROM ({aggregate}) AS agg
+    WHERE s.id = agg.id AND ({drifted})
+"""
+
+COUNT = """
+    SELECT COUNT(*)
+    FROM chat_chatsession AS s
+    JOIN ({aggregate}) AS agg ON s.id = agg.id
+    WHERE {drifted}
+"""
+
+# Null-safe "differs" per backend (UPDATE ... FROM needs SQLite 3.33+).
+DISTINCT = {
+    "postgresql": "IS DISTINCT FROM",
+    "sqlite": "IS NOT",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute ChatSession message/lead counters and first/last message "
+        "timestamps from chat_message and chat_lead with set-based UPDATEs, "
+        "one session-id range per batch. Reports how many sessions were corrected."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=20000, help="Session ids per UPDATE.")
+        parser.add_argument("--ids", type=int, nargs="+", help="Only these session ids.")
+        parser.add_argument("--since", help="Only sessions created on/after this date (YYYY-MM-DD).")
+        parser.add_argument("--bot", help='Only this bot\'s sessions ("default" = the built-in bot).')
+        parser.add_argument("--dry-run", action="store_true", help="Count drifted sessions, change nothing.")
+
+    def handle(self, *args, **opts):
+        if connection.vendor not in DISTINCT:
+            raise CommandError(f"reconcile_counters supports {', '.join(DISTINCT)}, not {connection.vendor}.")
+
+        sessions = self.select_sessions(opts)
+        bounds = sessions.aggregate(lo=Min("id"), hi=Max("id"))
+        lo, hi = bounds["lo"], bounds["hi"]
+        if lo is None:
+            self.stdout.write("No sessions to reconcile.")
+            return
+
+        scope_sql, scope_params = self.scope(sessions, opts)
+        aggregate = AGGREGATE.format(scope=scope_sql)
+        drifted = DRIFTED.format(distinct=DISTINCT[connection.vendor])
+        template = COUNT if opts["dry_run"] else UPDATE
+        sql = template.format(aggregate=aggregate, drifted=drifted)
+
+        started = time.perf_counter()
+        corrected = 0
+        for start in range(lo, hi + 1, opts["batch_size"]):
+            # [lo, hi) for the message, lead and session ranges, then the filter's own params
+            params = [start, start + opts["batch_size"]] * 3 + scope_params
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                corrected += cursor.fetchone()[0] if opts["dry_run"] else cursor.rowcount
+
+        verb = "would correct" if opts["dry_run"] else "corrected"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Checked session ids {lo}..{hi}: {verb} {corrected} sessions in {time.perf_counter() - started:.1f}s"
+            )
+        )
+
+    def select_sessions(self, opts):
+        sessions = ChatSession.objects.all()
+        if opts["ids"]:
+            sessions = sessions.filter(id__in=opts["ids"])
+        if opts["since"]:
+            try:
+                since = datetime.strptime(opts["since"], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("--since must be YYYY-MM-DD")
+            sessions = sessions.filter(created_at__date__gte=since)
+        if opts["bot"] == "default":
+            sessions = sessions.filter(bot__isnull=True)
+        elif opts["bot"]:
+            sessions = sessions.filter(bot__slug=opts["bot"])
+        return sessions
+
+    def scope(self, sessions, opts):
+        """Extra `AND cs.id IN (...)` for filtered runs (none for a full run)."""
+        if not (opts["ids"] or opts["since"] or opts["bot"]):
+            return "", []
+        sql, params = sessions.values("id").query.sql_with_params()
+        return f"AND cs.id IN ({sql})", list(params)
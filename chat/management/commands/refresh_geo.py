@@ -0,0 +1,63 @@
+import csv
+import gzip
+import io
+import tempfile
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.geo import write_dataset
+
+# Column positions of (start_ip, end_ip, country, region, city) per input format.
+FORMATS = {
+    # start_ip,end_ip,country,region,city[,...]
+    "simple": (0, 1, 2, 3, 4),
+    # DB-IP "IP to City Lite": start,end,continent,country_code,stateprov,city,lat,lon
+    "dbip": (0, 1, 3, 4, 5),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Download (or read) an IP-range CSV and compile it into the local geo "
+        "dataset used by enrich_session_geo. Safe to run while the app is serving."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "source",
+            nargs="?",
+            help="Path or http(s) URL of the CSV (optionally .gz). Defaults to GEOIP_DATASET_URL.",
+        )
+        parser.add_argument("--format", choices=sorted(FORMATS), default="dbip")
+        parser.add_argument("--output", help="Defaults to GEOIP_DB_PATH.")
+
+    def handle(self, *args, **opts):
+        source = opts["source"] or settings.GEOIP_DATASET_URL
+        if not source:
+            raise CommandError("No source given and GEOIP_DATASET_URL is not set.")
+        output = opts["output"] or str(settings.GEOIP_DB_PATH)
+        columns = FORMATS[opts["format"]]
+
+        with self.open_source(source) as raw:
+            if source.endswith(".gz"):
+                raw = gzip.open(raw)
+            reader = csv.reader(io.TextIOWrapper(raw, encoding="utf-8", newline=""))
+            ranges = (tuple(row[i] for i in columns) for row in reader if len(row) > max(columns))
+            n4, n6 = write_dataset(output, ranges)
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {n4} IPv4 and {n6} IPv6 ranges to {output}"))
+
+    def open_source(self, source):
+        if not source.startswith(("http://", "https://")):
+            return open(source, "rb")
+
+        self.stdout.write(f"Downloading {source} ...")
+        tmp = tempfile.TemporaryFile()
+        with requests.get(source, stream=True, timeout=60) as resp:
+            resp.raise_for_status()
+            for chunk in resp.iter_content(chunk_size=1 << 20):
+                tmp.write(chunk)
+        tmp.seek(0)
+        return tmp
@@ -0,0 +1,83 @@
+"""
+Full-text index over Message.text, used by chat/search.py.
+
+- SQLite: an external-content FTS5 table kept in sync by triggers.
+- PostgreSQL: a GIN index on to_tsvector('english', text); the expression is
+  recomputed by Postgres on every insert/update, so there's nothing to sync.
+- Anything else: no index; search falls back to a plain icontains scan.
+
+Note: on SQLite, a later migration that rebuilds the chat_message table
+(AlterField and friends) drops these triggers and must recreate them.
+"""
+
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE chat_message_fts USING fts5(
+        text, content='chat_message', content_rowid='id', tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER chat_message_fts_ai AFTER INSERT ON chat_message BEGIN
+        INSERT INTO chat_message_fts(rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER chat_message_fts_ad AFTER DELETE ON chat_message BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER chat_message_fts_au AFTER UPDATE OF text ON chat_message BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO chat_message_fts(rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+    # Index messages that already exist.
+    "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS chat_message_fts_au",
+    "DROP TRIGGER IF EXISTS chat_message_fts_ad",
+    "DROP TRIGGER IF EXISTS chat_message_fts_ai",
+    "DROP TABLE IF EXISTS chat_message_fts",
+]
+
+POSTGRES_FORWARD = [
+    "CREATE INDEX chat_message_text_fts ON chat_message USING GIN (to_tsvector('english', text))",
+]
+
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS chat_message_text_fts",
+]
+
+
+def run_for_vendor(sqlite_statements, postgres_statements):
+    def run(apps, schema_editor):
+        vendor = schema_editor.connection.vendor
+        if vendor == "sqlite":
+            statements = sqlite_statements
+        elif vendor == "postgresql":
+            statements = postgres_statements
+        else:
+            return
+        for sql in statements:
+            schema_editor.execute(sql)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_chatsession_bot_message_count_chatsession_city_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor(SQLITE_FORWARD, POSTGRES_FORWARD),
+            run_for_vendor(SQLITE_BACKWARD, POSTGRES_BACKWARD),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.8 on 2026-10-19 19:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_message_fulltext_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Bot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(unique=True)),
+                ('name', models.CharField(max_length=100)),
+                ('is_active', models.BooleanField(default=True)),
+                ('system_prompt', models.TextField()),
+                ('knowledge_links', models.JSONField(blank=True, default=list)),
+                ('gated_resources', models.JSONField(blank=True, default=list)),
+                ('contact_keywords', models.JSONField(blank=True, default=list)),
+                ('contact_prompt', models.TextField(blank=True)),
+                ('gated_prompt', models.TextField(blank=True)),
+                ('lead_notification_email', models.EmailField(blank=True, max_length=254)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='bot',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='sessions', to='chat.bot'),
+        ),
+        migrations.AddField(
+            model_name='lead',
+            name='bot',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='leads', to='chat.bot'),
+        ),
+    ]
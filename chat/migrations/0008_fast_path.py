@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-19 19:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bot',
+            name='fast_answers',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.CreateModel(
+            name='FastPathHit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bot_slug', models.CharField(max_length=50)),
+                ('rule', models.CharField(max_length=100)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('last_hit_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('bot_slug', 'rule'), name='chat_fastpathhit_bot_rule')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-19 19:23
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_fast_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReplyJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('reply', models.TextField(blank=True)),
+                ('extras', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reply_jobs', to='chat.chatsession')),
+            ],
+        ),
+    ]
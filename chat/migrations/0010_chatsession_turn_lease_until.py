@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 19:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_replyjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='turn_lease_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-19 19:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_chatsession_turn_lease_until'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chatsession',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='lead',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='lead',
+            name='email',
+            field=models.EmailField(db_index=True, max_length=254),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['session', 'created_at'], name='chat_msg_session_created'),
+        ),
+    ]
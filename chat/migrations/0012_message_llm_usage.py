@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-19 19:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='cached_tokens',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='completion_tokens',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='llm_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='prompt_tokens',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
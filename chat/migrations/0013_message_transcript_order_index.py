@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-19 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_message_llm_usage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['session', 'created_at', 'id'], name='chat_msg_session_order'),
+        ),
+        # Dropped only after its replacement exists.
+        migrations.RemoveIndex(
+            model_name='message',
+            name='chat_msg_session_created',
+        ),
+    ]
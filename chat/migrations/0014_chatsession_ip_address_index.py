@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 19:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_message_transcript_order_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chatsession',
+            name='ip_address',
+            field=models.GenericIPAddressField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -1,12 +1,50 @@
+import uuid
+
 from django.db import models
 
-class ChatSession(models.Model):
+
+class Bot(models.Model):
+    """
+    One client's chatbot (tenant). Sessions/leads with no bot belong to the
+    built-in Dotswitch bot configured in views.py.
+
+    knowledge_links / gated_resources use the same shape as KNOWLEDGE_LINKS:
+    [{"label": ..., "url": ..., "keywords": [...]}, ...]
+    fast_answers uses the FAST_ANSWERS shape (see chat/fastpath.py).
+    """
+    slug = models.SlugField(unique=True)
+    name = models.CharField(max_length=100)
+    is_active = models.BooleanField(default=True)
+
+    system_prompt = models.TextField()
+    knowledge_links = models.JSONField(default=list, blank=True)
+    gated_resources = models.JSONField(default=list, blank=True)
+    # Empty = use the default contact-intent keywords.
+    contact_keywords = models.JSONField(default=list, blank=True)
+    # Empty = generic wording.
+    contact_prompt = models.TextField(blank=True)
+    gated_prompt = models.TextField(blank=True)
+    # Templated replies that skip the LLM; empty = every message goes to OpenAI.
+    fast_answers = models.JSONField(default=list, blank=True)
+
+    lead_notification_email = models.EmailField(blank=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
+    # Part of the compiled-profile cache key, so edits take effect immediately.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.slug})"
+
+
+class ChatSession(models.Model):
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
+    bot = models.ForeignKey(Bot, on_delete=models.PROTECT, null=True, blank=True, related_name="sessions")
     # later: ip, country, city, email, etc.
     
     # NEW: tracking fields
-    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    ip_address = models.GenericIPAddressField(null=True, blank=True, db_index=True)
     country = models.CharField(max_length=100, blank=True)
     region = models.CharField(max_length=100, blank=True)
     city = models.CharField(max_length=100, blank=True)
@@ -21,6 +59,10 @@ class ChatSession(models.Model):
     first_message_at = models.DateTimeField(null=True, blank=True)
     last_message_at = models.DateTimeField(null=True, blank=True)
 
+    # Held while a chat turn is being answered, so turns in one session run in
+    # order (see chat/turns.py). Null or in the past = free.
+    turn_lease_until = models.DateTimeField(null=True, blank=True)
+
     def __str__(self):
         return f"Session {self.id} ({self.created_at})"
 
@@ -35,6 +77,19 @@ class Message(models.Model):
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # LLM usage for assistant messages (null for templated/fallback replies).
+    prompt_tokens = models.PositiveIntegerField(null=True, blank=True)
+    cached_tokens = models.PositiveIntegerField(null=True, blank=True)
+    completion_tokens = models.PositiveIntegerField(null=True, blank=True)
+    llm_ms = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # A session's transcript in (created_at, id) order: admin inline,
+            # history reads and the cursor-paginated transcript pages
+            models.Index(fields=["session", "created_at", "id"], name="chat_msg_session_order"),
+        ]
+
     def __str__(self):
         return f"[{self.role}] {self.text[:40]}"
 
@@ -51,11 +106,76 @@ class Lead(models.Model):
         blank=True,
         related_name="leads",
     )
+    bot = models.ForeignKey(Bot, on_delete=models.PROTECT, null=True, blank=True, related_name="leads")
     name = models.CharField(max_length=255, blank=True)
-    email = models.EmailField()
+    email = models.EmailField(db_index=True)
     lead_type = models.CharField(max_length=50, choices=LEAD_TYPE_CHOICES, default="contact")
     message = models.TextField(blank=True)  # free-text context/intent
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     def __str__(self):
         return f"{self.email} ({self.lead_type})"
+
+
+class ReplyJob(models.Model):
+    """
+    A chat turn answered asynchronously (see chat/jobs.py): the POST returns
+    202 with this id and the widget polls /api/chat/jobs/<id>/ for the reply.
+    """
+    STATUS_CHOICES = (
+        ("pending", "Pending"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    )
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name="reply_jobs")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
+    reply = models.TextField(blank=True)
+    # links / gated_links / lead prompt, computed up front (they don't depend on the reply)
+    extras = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Job {self.id} ({self.status})"
+
+
+class FastPathHit(models.Model):
+    """How often each fast-path rule answered instead of the LLM."""
+    # Bot slug, or "default" for the built-in Dotswitch bot.
+    bot_slug = models.CharField(max_length=50)
+    rule = models.CharField(max_length=100)
+    hits = models.PositiveIntegerField(default=0)
+    last_hit_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["bot_slug", "rule"], name="chat_fastpathhit_bot_rule"),
+        ]
+
+    def __str__(self):
+        return f"{self.bot_slug}:{self.rule} ({self.hits})"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Stored outcome of a POST sent with an Idempotency-Key header (see
+    chat/idempotency.py). status_code stays null while the first request is
+    still running.
+    """
+    scope = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    # sha256 of the request, so a reused key with a different body is rejected
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    locked_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["scope", "key"], name="chat_idempotency_scope_key"),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.key}"
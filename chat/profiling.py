@@ -0,0 +1,157 @@
+"""
+Opt-in sampling profiler for slow production requests.
+
+A request is profiled when it carries `X-Profile: <PROFILE_TOKEN>` or wins
+the PROFILE_SAMPLE_RATE dice roll. While it runs, a helper thread snapshots
+the request thread's stack every PROFILE_INTERVAL_MS and counts identical
+stacks. The result is written in collapsed-stack format ("a;b;c 12" per
+line, what flamegraph.pl / speedscope read) to PROFILE_DIR, which keeps
+only the newest PROFILE_RING_SIZE files. Staff can list and download them
+at /api/chat/profiles/.
+
+When neither trigger applies the cost is one header lookup and a setting
+check per request.
+"""
+
+import functools
+import hmac
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+HEADER = "X-Profile"
+
+# <time_ns>-<view>-<status>-<ms>ms.folded; anything else in the directory is ignored.
+PROFILE_NAME_RE = re.compile(r"^(\d+)-([a-z_]+)-(\d{3})-(\d+)ms\.folded$")
+
+
+def should_profile(request):
+    token = settings.PROFILE_TOKEN
+    if token:
+        sent = request.headers.get(HEADER)
+        if sent and hmac.compare_digest(sent, token):
+            return True
+    rate = settings.PROFILE_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+def collapse(frame):
+    """One stack as "outer;...;inner" frame names."""
+    names = []
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "?")
+        names.append(f"{module}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Sampler(threading.Thread):
+    """Samples one thread's stack until stopped."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+    def stop(self):
+        self.done.set()
+        self.join()
+        return self.stacks
+
+
+def save_profile(view_name, status_code, elapsed_ms, stacks):
+    directory = settings.PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    name = f"{time.time_ns()}-{view_name}-{status_code}-{elapsed_ms}ms.folded"
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as fh:
+        for stack, count in stacks.most_common():
+            fh.write(f"{stack} {count}\n")
+    os.replace(tmp_path, os.path.join(directory, name))
+
+    # Bounded ring: drop the oldest profiles beyond PROFILE_RING_SIZE.
+    for old in list_profiles()[settings.PROFILE_RING_SIZE:]:
+        try:
+            os.remove(os.path.join(directory, old["name"]))
+        except OSError:
+            pass
+    return name
+
+
+def list_profiles():
+    """Stored profiles, newest first."""
+    try:
+        names = os.listdir(settings.PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names:
+        match = PROFILE_NAME_RE.match(name)
+        if match:
+            created_ns, view_name, status_code, elapsed_ms = match.groups()
+            profiles.append(
+                {
+                    "name": name,
+                    "created_at": datetime.fromtimestamp(int(created_ns) / 1e9, tz=timezone.utc),
+                    "view": view_name,
+                    "status": int(status_code),
+                    "ms": int(elapsed_ms),
+                }
+            )
+    profiles.sort(key=lambda p: p["name"], reverse=True)
+    return profiles
+
+
+def profile_path(name):
+    """Absolute path of a stored profile, or None for anything that isn't one."""
+    if not PROFILE_NAME_RE.match(name):
+        return None
+    path = os.path.join(settings.PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def profiled(view_name):
+    """Decorator: sample this view when should_profile() says so. Put it outermost."""
+
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not should_profile(request):
+                return view_func(request, *args, **kwargs)
+
+            sampler = Sampler(threading.get_ident(), settings.PROFILE_INTERVAL_MS / 1000)
+            sampler.start()
+            started = time.perf_counter()
+            status_code = 500
+            try:
+                response = view_func(request, *args, **kwargs)
+                status_code = response.status_code
+                return response
+            finally:
+                stacks = sampler.stop()
+                elapsed_ms = round((time.perf_counter() - started) * 1000)
+                try:
+                    save_profile(view_name, status_code, elapsed_ms, stacks)
+                except OSError as e:
+                    print("Profile save error:", e)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,29 @@
+from rest_framework.utils import encoders
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # optional speedup; stock renderer otherwise
+    orjson = None
+
+_drf_default = encoders.JSONEncoder().default
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Drop-in JSONRenderer that serializes with orjson when it's installed.
+
+    Anything orjson can't handle natively (lazy strings, Decimals, querysets...)
+    goes through DRF's own encoder, and pretty-printed output (indent) or
+    payloads orjson rejects fall back to the stock implementation.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            return orjson.dumps(data, default=_drf_default, option=orjson.OPT_UTC_Z)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
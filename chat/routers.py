@@ -0,0 +1,66 @@
+"""
+Route the dashboard's heavy read-only aggregates to an optional `analytics`
+database (a read replica in production), so they don't compete with the
+chat write path on `default`.
+
+Django routers only see the model, not the view, so views opt in with
+@analytics_view (or `with use_analytics_db():`). If ANALYTICS_DATABASE_URL
+isn't configured everything stays on `default`.
+"""
+
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+ANALYTICS_DB = "analytics"
+
+_analytics_reads = ContextVar("analytics_reads", default=False)
+
+
+def analytics_configured():
+    return ANALYTICS_DB in settings.DATABASES
+
+
+@contextmanager
+def use_analytics_db():
+    token = _analytics_reads.set(True)
+    try:
+        yield
+    finally:
+        _analytics_reads.reset(token)
+
+
+def analytics_view(view_func):
+    """Send every ORM read made while rendering this view to the analytics DB."""
+
+    @functools.wraps(view_func)
+    def wrapper(*args, **kwargs):
+        with use_analytics_db():
+            return view_func(*args, **kwargs)
+
+    return wrapper
+
+
+class AnalyticsRouter:
+    def db_for_read(self, model, **hints):
+        if _analytics_reads.get() and analytics_configured():
+            return ANALYTICS_DB
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Writes always go to the primary, even inside an analytics view.
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Same data on both aliases, so relations across them are fine.
+        if {obj1._state.db, obj2._state.db} <= {"default", ANALYTICS_DB}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The analytics alias is a replica of default; never migrate it directly.
+        if db == ANALYTICS_DB:
+            return False
+        return None
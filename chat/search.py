@@ -0,0 +1,154 @@
+"""
+Ranked full-text search over chat transcripts.
+
+Backed by the index from migration 0005: FTS5 on SQLite, a GIN tsvector index
+on PostgreSQL. Results are grouped per session (best-matching message first)
+and paginated without a COUNT(*) by fetching one extra row.
+"""
+
+import re
+
+from django.db import connections, router
+
+from .models import ChatSession, Message
+
+SNIPPET_START = "[["
+SNIPPET_END = "]]"
+
+# MATERIALIZED stops SQLite flattening the CTE into the aggregate, where
+# bm25() isn't allowed (needs SQLite >= 3.35).
+SQLITE_SEARCH = """
+    WITH hits AS MATERIALIZED (
+        SELECT rowid AS message_id, bm25(chat_message_fts) AS score
+        FROM chat_message_fts
+        WHERE chat_message_fts MATCH %s
+    )
+    -- SQLite fills the bare message_id column from the MIN(score) row.
+    SELECT m.session_id, COUNT(*) AS hits, MIN(h.score) AS score, h.message_id
+    FROM hits h
+    JOIN chat_message m ON m.id = h.message_id
+    GROUP BY m.session_id
+    ORDER BY score, m.session_id DESC
+    LIMIT %s OFFSET %s
+"""
+
+# snippet() is the expensive part, so only run it for the best hit on each page row.
+SQLITE_SNIPPETS = """
+    SELECT rowid, snippet(chat_message_fts, 0, %s, %s, '…', 16)
+    FROM chat_message_fts
+    WHERE chat_message_fts MATCH %s AND rowid IN ({placeholders})
+"""
+
+POSTGRES_SEARCH = """
+    WITH q AS (SELECT websearch_to_tsquery('english', %s) AS query),
+    hits AS (
+        SELECT m.session_id, m.text,
+               ts_rank(to_tsvector('english', m.text), q.query) AS score,
+               COUNT(*) OVER (PARTITION BY m.session_id) AS hits
+        FROM chat_message m, q
+        WHERE to_tsvector('english', m.text) @@ q.query
+    ),
+    best AS (
+        SELECT DISTINCT ON (session_id) session_id, text, score, hits
+        FROM hits
+        ORDER BY session_id, score DESC
+    ),
+    page AS (
+        SELECT * FROM best ORDER BY score DESC, session_id DESC LIMIT %s OFFSET %s
+    )
+    -- ts_headline is expensive, so only run it for the rows on this page.
+    SELECT page.session_id, page.hits, page.score,
+           ts_headline('english', page.text, q.query,
+                       'StartSel=' || %s || ', StopSel=' || %s || ', MaxWords=30, MinWords=10')
+    FROM page, q
+    ORDER BY page.score DESC, page.session_id DESC
+"""
+
+
+def snippet_parts(snippet):
+    """Split a snippet into [(text, is_match), ...] so templates can highlight safely."""
+    parts = []
+    for i, chunk in enumerate(re.split(f"{re.escape(SNIPPET_START)}|{re.escape(SNIPPET_END)}", snippet or "")):
+        if chunk:
+            parts.append((chunk, i % 2 == 1))
+    return parts
+
+
+def fts5_query(text):
+    """Quote each word so user input can't trip FTS5 query syntax (AND all terms)."""
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{w}"' for w in words)
+
+
+def search_transcripts(query, page=1, per_page=20):
+    """
+    Return (results, has_next). Each result is a dict with session, hits (how
+    many messages in the session matched), score, snippet (matches wrapped in
+    SNIPPET_START / SNIPPET_END) and snippet_parts (see snippet_parts()).
+    """
+    page = max(1, page)
+    limit, offset = per_page + 1, (page - 1) * per_page
+
+    alias = router.db_for_read(Message)
+    vendor = connections[alias].vendor
+
+    if vendor == "sqlite":
+        match = fts5_query(query)
+        if not match:
+            return [], False
+        rows = fetch_rows(alias, SQLITE_SEARCH, [match, limit, offset])
+        rows = add_sqlite_snippets(alias, match, rows[:per_page]) + rows[per_page:]
+    elif vendor == "postgresql":
+        rows = fetch_rows(alias, POSTGRES_SEARCH, [query, limit, offset, SNIPPET_START, SNIPPET_END])
+    else:
+        rows = fallback_search(query, alias, limit, offset)
+
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+
+    sessions = ChatSession.objects.using(alias).in_bulk([row[0] for row in rows])
+    results = [
+        {
+            "session": sessions[session_id],
+            "hits": hits,
+            "score": score,
+            "snippet": snippet,
+            "snippet_parts": snippet_parts(snippet),
+        }
+        for session_id, hits, score, snippet in rows
+        if session_id in sessions
+    ]
+    return results, has_next
+
+
+def add_sqlite_snippets(alias, match, rows):
+    """Swap each row's best message id for that message's highlighted snippet."""
+    if not rows:
+        return rows
+    message_ids = [row[3] for row in rows]
+    sql = SQLITE_SNIPPETS.format(placeholders=", ".join(["%s"] * len(message_ids)))
+    snippets = dict(fetch_rows(alias, sql, [SNIPPET_START, SNIPPET_END, match, *message_ids]))
+    return [(session_id, hits, score, snippets.get(message_id, "")) for session_id, hits, score, message_id in rows]
+
+
+def fetch_rows(alias, sql, params):
+    with connections[alias].cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def fallback_search(query, alias, limit, offset):
+    """Unindexed icontains scan for databases without a full-text index."""
+    matches = (
+        Message.objects.using(alias)
+        .filter(text__icontains=query)
+        .values_list("session_id", "text")
+        .order_by("-created_at")
+    )
+    per_session = {}
+    for session_id, text in matches.iterator():
+        if session_id in per_session:
+            per_session[session_id][1] += 1
+        else:
+            per_session[session_id] = [session_id, 1, 0, text[:200]]
+    return [tuple(row) for row in list(per_session.values())[offset:offset + limit]]
@@ -0,0 +1,233 @@
+"""
+Per-bot (tenant) runtime configuration.
+
+A BotProfile is everything a chat turn needs from a tenant -- system prompt,
+compiled keyword matchers, lead prompts, notification address. Building one
+means compiling regexes for every link entry, so profiles are kept in a
+bounded LRU keyed on (bot id, updated_at): one worker pool can serve many
+bots, editing a bot invalidates its entry, and idle bots age out.
+"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import fastpath
+
+DEFAULT_CONTACT_PROMPT = "It sounds like you'd like to talk to the team. Share your email and we'll reach out personally."
+DEFAULT_GATED_PROMPT = "I can share a detailed PDF for this. Drop your name and email so I can unlock the link for you."
+
+# Brand-neutral contact-intent phrases for bots that don't define their own.
+DEFAULT_CONTACT_KEYWORDS = [
+    "talk to you",
+    "talk to someone",
+    "reach out",
+    "contact you",
+    "speak to",
+    "schedule a call",
+    "book a call",
+    "jump on a call",
+    "rate card",
+    "contact",
+    "pdf",
+    "quote",
+    "proposal",
+    "free audit",
+    "scope",
+    "custom plan",
+]
+
+
+def canonical_prompt(text):
+    """
+    Normalize line endings and trailing whitespace, so the same prompt is
+    byte-identical whichever worker (or admin edit) produced it.
+    """
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def compile_keywords(keywords):
+    """One case-insensitive substring matcher for a keyword list (None if empty)."""
+    keywords = [kw.lower() for kw in keywords if kw]
+    if not keywords:
+        return None
+    return re.compile("|".join(re.escape(kw) for kw in keywords))
+
+
+class BotProfile:
+    def __init__(
+        self,
+        name,
+        system_prompt,
+        knowledge_links,
+        gated_resources,
+        contact_keywords,
+        contact_prompt="",
+        gated_prompt="",
+        lead_notification_email=None,
+        fast_answers=(),
+    ):
+        self.name = name
+        self.system_prompt = canonical_prompt(system_prompt)
+        # Static content only, identical for every session of this bot: the
+        # provider's prompt cache can reuse it as long as it stays the prefix.
+        self.prompt_prefix = ({"role": "system", "content": self.system_prompt},)
+        self.cache_key = "bot-" + hashlib.sha256(self.system_prompt.encode()).hexdigest()[:16]
+        self.lead_notification_email = lead_notification_email
+        self.contact_prompt = contact_prompt or DEFAULT_CONTACT_PROMPT
+        self.gated_prompt = gated_prompt or DEFAULT_GATED_PROMPT
+
+        self.link_matchers = self._compile_entries(knowledge_links)
+        self.gated_matchers = self._compile_entries(gated_resources)
+        self.contact_matcher = compile_keywords(contact_keywords)
+        self.fast_rules = fastpath.compile_rules(fast_answers)
+
+        # If nothing matches but they mention the brand, suggest the first couple of links.
+        self.brand_keyword = name.lower()
+        self.brand_links = [link for _, link in self.link_matchers[:2]]
+
+    def history(self, transcript):
+        """
+        Messages for the LLM: the static prefix first, then the (role, text)
+        transcript in order. Per-session or dynamic context must go after the
+        prefix, never into it.
+        """
+        return [*self.prompt_prefix, *({"role": role, "content": text} for role, text in transcript)]
+
+    @staticmethod
+    def _compile_entries(entries):
+        compiled = []
+        for entry in entries:
+            matcher = compile_keywords(entry.get("keywords", []))
+            if matcher is not None:
+                compiled.append((matcher, {"label": entry["label"], "url": entry["url"]}))
+        return compiled
+
+    def relevant_links(self, user_message):
+        """Up to 3 service links for the latest user message."""
+        if not user_message:
+            return []
+
+        text = user_message.lower()
+        matches = [link for matcher, link in self.link_matchers if matcher.search(text)]
+
+        if not matches and self.brand_keyword in text:
+            matches = list(self.brand_links)
+
+        # Limit to 3 buttons to keep UI clean
+        return matches[:3]
+
+    def gated_links(self, user_message):
+        if not user_message:
+            return []
+        text = user_message.lower()
+        return [link for matcher, link in self.gated_matchers if matcher.search(text)]
+
+    def looks_like_contact_intent(self, user_message):
+        if not user_message or self.contact_matcher is None:
+            return False
+        return self.contact_matcher.search(user_message.lower()) is not None
+
+    def reply_extras(self, user_message):
+        """
+        Everything that rides along with a bot reply: service links, gated links
+        and (optionally) a prompt asking for the visitor's email.
+        """
+        links = self.relevant_links(user_message)
+        gated_links = self.gated_links(user_message)
+        needs_lead_for_links = bool(gated_links)
+
+        # Determine if we should prompt for contact even without gated links
+        lead_suggestion = None
+        if needs_lead_for_links:
+            lead_suggestion = self.gated_prompt
+        elif self.looks_like_contact_intent(user_message):
+            lead_suggestion = self.contact_prompt
+
+        return {
+            "links": links,
+            "gated_links": gated_links,
+            "needs_lead_for_links": needs_lead_for_links,
+            "lead_suggestion": lead_suggestion,
+        }
+
+
+    def fast_answer(self, user_message):
+        """
+        A FastAnswer when a fast-path rule confidently covers this message,
+        else None (the caller asks the LLM).
+        """
+        if not settings.FAST_PATH_ENABLED or not self.fast_rules or not user_message:
+            return None
+        confidence, entry = fastpath.best_rule(self.fast_rules, user_message)
+        if entry is None or confidence < settings.FAST_PATH_MIN_CONFIDENCE:
+            return None
+
+        extras = self.reply_extras(user_message)
+        # The rule's own gated resources, even if the message didn't name them
+        # ("show me your work" still gets the portfolio PDF and the lead prompt).
+        for _, link in self.gated_matchers:
+            if link["label"] in entry.get("gated", ()) and link not in extras["gated_links"]:
+                extras["gated_links"].append(link)
+        if extras["gated_links"]:
+            extras["needs_lead_for_links"] = True
+            extras["lead_suggestion"] = self.gated_prompt
+        elif entry.get("lead") == "contact" and not extras["lead_suggestion"]:
+            extras["lead_suggestion"] = self.contact_prompt
+        return fastpath.FastAnswer(entry["name"], entry["reply"], extras)
+
+
+class ProfileCache:
+    """Thread-safe LRU of compiled BotProfiles."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, build):
+        with self.lock:
+            profile = self.entries.get(key)
+            if profile is not None:
+                self.entries.move_to_end(key)
+                return profile
+
+        # Build outside the lock; a rare duplicate build is cheaper than blocking.
+        profile = build()
+
+        with self.lock:
+            self.entries[key] = profile
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return profile
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+profile_cache = ProfileCache(settings.BOT_PROFILE_CACHE_SIZE)
+
+
+def build_profile(bot):
+    return BotProfile(
+        name=bot.name,
+        system_prompt=bot.system_prompt,
+        knowledge_links=bot.knowledge_links,
+        gated_resources=bot.gated_resources,
+        contact_keywords=bot.contact_keywords or DEFAULT_CONTACT_KEYWORDS,
+        contact_prompt=bot.contact_prompt,
+        gated_prompt=bot.gated_prompt,
+        lead_notification_email=bot.lead_notification_email or None,
+        fast_answers=bot.fast_answers,
+    )
+
+
+def get_bot_profile(bot):
+    key = (bot.pk, bot.updated_at)
+    return profile_cache.get(key, lambda: build_profile(bot))
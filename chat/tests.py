@@ -1,3 +1,1176 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.db import DatabaseError, connection, connections
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import geo, llm
+from .models import Bot, ChatSession, FastPathHit, IdempotencyKey, Lead, Message, ReplyJob
+from .routers import ANALYTICS_DB, use_analytics_db
+from .tenants import canonical_prompt, get_bot_profile, profile_cache
+from .websocket import chat_socket
+
+STUB_REPLY = "Stubbed reply from the LLM."
+
+
+class FakeGeoDB:
+    def lookup(self, ip):
+        return {"country": "India", "region": "Karnataka", "city": "Bengaluru"}
+
+
+@override_settings(
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    LEAD_NOTIFICATION_EMAIL="leads@example.com",
+)
+class EndpointTestCase(TestCase):
+    """
+    Base for endpoint tests: OpenAI, geo lookups and SMTP are all stubbed, so
+    nothing here touches the network.
+    """
+
+    # Session sizes (messages already stored) each endpoint is exercised at.
+    SIZES = (0, 10, 250)
+
+    def setUp(self):
+        patches = [
+            mock.patch(
+                "chat.llm.complete",
+                return_value=llm.Completion(STUB_REPLY, prompt_tokens=1500, cached_tokens=1280, completion_tokens=12, llm_ms=40),
+            ),
+            mock.patch("chat.views.get_geo_db", return_value=FakeGeoDB()),
+            mock.patch("chat.geo.requests.get", side_effect=AssertionError("network call")),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def make_session(self, n_messages, **fields):
+        session = ChatSession.objects.create(user_message_count=n_messages // 2, **fields)
+        Message.objects.bulk_create(
+            Message(
+                session=session,
+                role="user" if i % 2 == 0 else "assistant",
+                text=f"message {i} about shopify webstores and pricing " * 4,
+            )
+            for i in range(n_messages)
+        )
+        return session
+
+    def make_leads(self, n, session=None):
+        Lead.objects.bulk_create(
+            Lead(session=session, email=f"visitor{i % 7}@example.com", lead_type="contact" if i % 3 else "gated_info")
+            for i in range(n)
+        )
+
+    def post_json(self, url, data, **extra):
+        return self.client.post(url, data, content_type="application/json", **extra)
+
+    def login_staff(self):
+        user = User.objects.create_user("staff", "staff@example.com", "pw", is_staff=True)
+        self.client.force_login(user)
+
+
+class ChatMessageQueryTests(EndpointTestCase):
+    def test_new_session(self):
+        # insert session, geo update, user msg, stamp session, history read, bot msg, end turn, transcript read
+        with self.assertNumQueries(8):
+            resp = self.post_json("/api/chat/message/", {"message": "hi"}, REMOTE_ADDR="8.8.8.8")
+        self.assertEqual(resp.status_code, 200)
+        session = ChatSession.objects.get(id=resp.json()["session_id"])
+        self.assertEqual(session.country, "India")
+
+    def test_existing_session_v1_is_constant(self):
+        for size in self.SIZES:
+            with self.subTest(messages=size):
+                session = self.make_session(size)
+                # session get, begin turn, user msg, stamp session, history read, bot msg, end turn,
+                # transcript read
+                with self.assertNumQueries(8):
+                    resp = self.post_json("/api/chat/message/", {"message": "hi", "session_id": session.id})
+                self.assertEqual(len(resp.json()["messages"]), size + 2)
+
+    def test_existing_session_v2_is_constant(self):
+        for size in self.SIZES:
+            with self.subTest(messages=size):
+                session = self.make_session(size)
+                # v2 skips the transcript read
+                with self.assertNumQueries(7):
+                    resp = self.post_json(
+                        "/api/chat/message/?version=2", {"message": "hi", "session_id": session.id}
+                    )
+                self.assertEqual(resp.json()["reply"], STUB_REPLY)
+
+
+class SubmitLeadQueryTests(EndpointTestCase):
+    def test_with_session_is_constant(self):
+        for size in self.SIZES:
+            with self.subTest(messages=size):
+                session = self.make_session(size)
+                mail.outbox.clear()
+                # session get, lead insert, counter update, transcript excerpt read
+                with self.assertNumQueries(4):
+                    resp = self.post_json("/api/chat/lead/", {"email": "v@example.com", "session_id": session.id})
+                self.assertEqual(resp.status_code, 201)
+                self.assertEqual(len(mail.outbox), 1)
+
+    def test_without_session(self):
+        with self.assertNumQueries(1):
+            resp = self.post_json("/api/chat/lead/", {"email": "v@example.com"})
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class AnalyticsQueryTests(EndpointTestCase):
+    DATA_SIZES = (1, 25, 120)
+
+    def seed(self, n):
+        for i in range(n):
+            session = self.make_session(2, country="India" if i % 2 else "Germany")
+            self.make_leads(1, session=session)
+
+    def test_dashboard_is_constant(self):
+        self.login_staff()
+        seeded = 0
+        for size in self.DATA_SIZES:
+            with self.subTest(sessions=size):
+                self.seed(size - seeded)
+                seeded = size
+                # 2 auth + 8 aggregates/lists
+                with self.assertNumQueries(10):
+                    resp = self.client.get("/api/chat/dashboard/")
+                self.assertEqual(resp.status_code, 200)
+
+    def test_lead_list_is_constant(self):
+        self.login_staff()
+        seeded = 0
+        for size in self.DATA_SIZES:
+            with self.subTest(leads=size):
+                self.seed(size - seeded)
+                seeded = size
+                # 2 auth + leads (with sessions joined) + unique emails
+                with self.assertNumQueries(4):
+                    resp = self.client.get("/api/chat/leads-view/")
+                self.assertEqual(resp.status_code, 200)
+
+    def test_stats_is_constant(self):
+        self.login_staff()
+        seeded = 0
+        for size in self.DATA_SIZES:
+            with self.subTest(sessions=size):
+                self.seed(size - seeded)
+                seeded = size
+                # 2 auth + 5 aggregates
+                with self.assertNumQueries(7):
+                    resp = self.client.get("/api/chat/stats/")
+                self.assertEqual(resp.json()["total_sessions"], size)
+
+    def test_stats_is_staff_only(self):
+        self.assertIn(self.client.get("/api/chat/stats/").status_code, (401, 403))
+        user = User.objects.create_user("client", "client@example.com", "pw")
+        self.client.force_login(user)
+        self.assertEqual(self.client.get("/api/chat/stats/?bot=acme").status_code, 403)
+
+    def test_transcript_search_is_constant(self):
+        self.login_staff()
+        seeded = 0
+        for size in self.DATA_SIZES:
+            with self.subTest(sessions=size):
+                self.seed(size - seeded)
+                seeded = size
+                # 2 auth + ranked hits + snippets + sessions
+                with self.assertNumQueries(5):
+                    resp = self.client.get("/api/chat/search/?q=shopify")
+                self.assertEqual(resp.status_code, 200)
+
+
+class AnalyticsRoutingTests(TransactionTestCase):
+    """
+    With an `analytics` alias configured, dashboard reads go there and writes
+    stay on default. The alias mirrors the test DB (committed rows are visible
+    on both) and is added in setUpClass, as ANALYTICS_DATABASE_URL isn't set
+    when the runner creates the test databases; "__all__" then resolves to
+    {"default", "analytics"} for this class.
+    """
+
+    databases = "__all__"
+    READ_URLS = (
+        "/api/chat/stats/",
+        "/api/chat/dashboard/",
+        "/api/chat/leads-view/",
+        "/api/chat/search/?q=shopify",
+    )
+
+    @classmethod
+    def setUpClass(cls):
+        connections.settings[ANALYTICS_DB] = {**connections["default"].settings_dict, "TEST": {"MIRROR": "default"}}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[ANALYTICS_DB].close()
+        del connections[ANALYTICS_DB]
+        del connections.settings[ANALYTICS_DB]
+
+    def setUp(self):
+        session = ChatSession.objects.create(user_message_count=1, bot_message_count=1)
+        Message.objects.create(session=session, role="user", text="do you build shopify stores?")
+        Message.objects.create(session=session, role="assistant", text="We build shopify stores.")
+        Lead.objects.create(session=session, email="v@example.com")
+        user = User.objects.create_user("staff", "staff@example.com", "pw", is_staff=True)
+        self.client.force_login(user)
+
+    def chat_queries(self, captured):
+        return [q["sql"] for q in captured if '"chat_' in q["sql"]]
+
+    def test_dashboard_reads_go_to_analytics(self):
+        for url in self.READ_URLS:
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connections["default"]) as default_queries, \
+                        CaptureQueriesContext(connections[ANALYTICS_DB]) as analytics_queries:
+                    resp = self.client.get(url)
+                self.assertEqual(resp.status_code, 200)
+                self.assertTrue(self.chat_queries(analytics_queries))
+                self.assertEqual(self.chat_queries(default_queries), [])
+
+    def test_writes_go_to_default(self):
+        with use_analytics_db():
+            self.assertEqual(ChatSession.objects.all().db, ANALYTICS_DB)
+            with CaptureQueriesContext(connections[ANALYTICS_DB]) as analytics_queries:
+                session = ChatSession.objects.create()
+                ChatSession.objects.filter(pk=session.pk).update(lead_count=1)
+                Lead.objects.create(session=session, email="w@example.com")
+        self.assertEqual(session._state.db, "default")
+        self.assertEqual(len(analytics_queries), 0)
+        self.assertEqual(ChatSession.objects.get(pk=session.pk).lead_count, 1)
+
+    def test_without_alias_everything_stays_on_default(self):
+        with mock.patch.dict(connections.settings):
+            del connections.settings[ANALYTICS_DB]
+            with use_analytics_db():
+                self.assertEqual(ChatSession.objects.all().db, "default")
+            for url in self.READ_URLS:
+                with self.subTest(url=url):
+                    with CaptureQueriesContext(connections["default"]) as default_queries:
+                        resp = self.client.get(url)
+                    self.assertEqual(resp.status_code, 200)
+                    self.assertTrue(self.chat_queries(default_queries))
+
+
+class TenantTests(EndpointTestCase):
+    def setUp(self):
+        super().setUp()
+        profile_cache.clear()
+        self.addCleanup(profile_cache.clear)
+        self.bot = Bot.objects.create(
+            slug="acme",
+            name="Acme",
+            system_prompt="You are Acme's assistant.",
+            lead_notification_email="sales@acme.example",
+        )
+
+    def test_new_session_is_bound_to_bot(self):
+        resp = self.post_json("/api/chat/message/?version=2", {"message": "hello there", "bot": "acme"})
+        session = ChatSession.objects.get(id=resp.json()["session_id"])
+        self.assertEqual(session.bot, self.bot)
+        history = llm.complete.call_args.args[0]
+        self.assertEqual(history[0]["content"], canonical_prompt("You are Acme's assistant."))
+
+        # Later turns from the same widget continue the session.
+        resp = self.post_json("/api/chat/message/?version=2", {"message": "again", "session_id": session.id, "bot": "acme"})
+        self.assertEqual(resp.json()["session_id"], session.id)
+
+    def test_other_bots_session_is_not_continued(self):
+        other = Bot.objects.create(slug="other", name="Other", system_prompt="x")
+        session = self.make_session(2, bot=self.bot)
+
+        resp = self.post_json("/api/chat/message/", {"message": "again", "session_id": session.id, "bot": "other"})
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertNotEqual(data["session_id"], session.id)
+        self.assertEqual([m["text"] for m in data["messages"]], ["again", "Stubbed reply from the LLM."])
+        self.assertEqual(ChatSession.objects.get(id=data["session_id"]).bot, other)
+        self.assertEqual(session.messages.count(), 2)
+
+        self.post_json("/api/chat/lead/", {"email": "v@example.com", "session_id": session.id, "bot": "other"})
+        lead = Lead.objects.get()
+        self.assertEqual((lead.session, lead.bot), (None, other))
+        self.assertNotEqual(mail.outbox[0].to, ["sales@acme.example"])
+
+    def test_unknown_or_inactive_bot_is_rejected(self):
+        Bot.objects.create(slug="gone", name="Gone", system_prompt="x", is_active=False)
+        for slug in ("nope", "gone"):
+            with self.subTest(slug=slug):
+                resp = self.post_json("/api/chat/message/", {"message": "hi", "bot": slug})
+                self.assertEqual(resp.status_code, 400)
+        self.assertFalse(ChatSession.objects.exists())
+
+    def test_lead_goes_to_bot_inbox(self):
+        session = self.make_session(2, bot=self.bot)
+        self.post_json("/api/chat/lead/", {"email": "v@example.com", "session_id": session.id})
+        self.post_json("/api/chat/lead/", {"email": "w@example.com", "bot": "acme"})
+        self.assertEqual([m.to for m in mail.outbox], [["sales@acme.example"]] * 2)
+        self.assertTrue(mail.outbox[0].subject.startswith("[Acme Chatbot Lead]"))
+        self.assertEqual(Lead.objects.filter(bot=self.bot).count(), 2)
+
+    def test_analytics_filter_by_bot(self):
+        for _ in range(3):
+            self.make_session(2, bot=self.bot)
+        self.make_session(2)
+        self.login_staff()
+        for query, expected in (("", 4), ("?bot=acme", 3), ("?bot=default", 1), ("?bot=nope", 0)):
+            with self.subTest(query=query):
+                stats = self.client.get("/api/chat/stats/" + query).json()
+                self.assertEqual(stats["total_sessions"], expected)
+                dashboard = self.client.get("/api/chat/dashboard/" + query)
+                self.assertEqual(dashboard.context["total_sessions"], expected)
+
+    def test_profile_cache_misses_after_edit(self):
+        first = get_bot_profile(self.bot)
+        self.assertIs(get_bot_profile(Bot.objects.get(pk=self.bot.pk)), first)
+
+        self.bot.system_prompt = "You are Acme's new assistant."
+        self.bot.save()
+        edited = get_bot_profile(Bot.objects.get(pk=self.bot.pk))
+        self.assertIsNot(edited, first)
+        self.assertEqual(edited.system_prompt, canonical_prompt("You are Acme's new assistant."))
+
+
+class FastPathTests(EndpointTestCase):
+    def ask(self, text, session=None):
+        body = {"message": text}
+        if session is not None:
+            body["session_id"] = session.id
+        return self.post_json("/api/chat/message/?version=2", body).json()
+
+    def test_plain_question_skips_llm(self):
+        session = self.make_session(10)
+        data = self.ask("What's your pricing?", session)
+        self.assertFalse(llm.complete.called)
+        self.assertIn("scope-based", data["reply"])
+        self.assertIsNotNone(data["lead_suggestion"])
+
+        # session get, begin turn, user msg, stamp session, hit counter, bot msg, end turn -- no history read
+        with self.assertNumQueries(7):
+            self.ask("pricing", session)
+        self.assertEqual(FastPathHit.objects.get(bot_slug="default", rule="pricing").hits, 2)
+
+    def test_fast_answer_keeps_gated_links(self):
+        data = self.ask("portfolio please")
+        self.assertFalse(llm.complete.called)
+        self.assertTrue(data["needs_lead_for_links"])
+        self.assertEqual(len(data["gated_links"]), 1)
+
+    def test_rule_offers_its_gated_resource(self):
+        for text in ("show me your work", "case studies?"):
+            with self.subTest(text=text):
+                data = self.ask(text)
+                self.assertIn("portfolio", data["reply"])
+                self.assertTrue(data["needs_lead_for_links"])
+                self.assertEqual([link["label"] for link in data["gated_links"]], ["Dotswitch Portfolio (PDF)"])
+                self.assertIsNotNone(data["lead_suggestion"])
+        self.assertFalse(llm.complete.called)
+
+    def test_low_confidence_goes_to_llm(self):
+        data = self.ask("pricing for a 40 SKU shopify store running meta ads")
+        self.assertEqual(data["reply"], STUB_REPLY)
+        self.assertFalse(FastPathHit.objects.exists())
+
+    @override_settings(FAST_PATH_ENABLED=False)
+    def test_can_be_turned_off(self):
+        data = self.ask("pricing")
+        self.assertEqual(data["reply"], STUB_REPLY)
+
+
+class PromptCacheTests(EndpointTestCase):
+    def test_static_prefix_is_stable_across_turns(self):
+        session = self.make_session(0)
+        for text in ("hi", "tell me about seo", "and ads?"):
+            self.post_json("/api/chat/message/?version=2", {"message": text, "session_id": session.id})
+
+        calls = [c.args[0] for c in llm.complete.call_args_list]
+        cache_keys = {c.kwargs["cache_key"] for c in llm.complete.call_args_list}
+        self.assertEqual(len(cache_keys), 1)
+        self.assertEqual(calls[0][0], calls[2][0])
+        self.assertEqual(calls[0][0]["role"], "system")
+        # Each turn's history starts with the previous turn's full history.
+        self.assertEqual(calls[2][: len(calls[1])], calls[1])
+
+    def test_usage_is_recorded(self):
+        self.post_json("/api/chat/message/", {"message": "hi"})
+        reply = Message.objects.get(role="assistant")
+        self.assertEqual((reply.prompt_tokens, reply.cached_tokens, reply.llm_ms), (1500, 1280, 40))
+
+        out = StringIO()
+        call_command("prompt_cache_stats", stdout=out)
+        self.assertIn("85.3%", out.getvalue())
+
+    def test_stub_cache_hits_on_shared_prefix(self):
+        cache = llm.StubPromptCache()
+        prefix = [{"role": "system", "content": "x" * 8000}]
+        first, _ = cache.lookup(prefix + [{"role": "user", "content": "a"}])
+        prompt, cached = cache.lookup(prefix + [{"role": "user", "content": "b"}])
+        self.assertEqual(cached, 1920)  # the 2004-token system message, in 128-token blocks
+        # A changed prefix (e.g. a timestamp in the system prompt) misses entirely.
+        _, cached = cache.lookup([{"role": "system", "content": "y" + "x" * 7999}])
+        self.assertEqual(cached, 0)
+
+
+class InlineExecutor:
+    """Runs reply jobs immediately, in the test's own DB transaction."""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+@override_settings(CHAT_ASYNC_THRESHOLD=2)
+class AsyncJobTests(EndpointTestCase):
+    def setUp(self):
+        super().setUp()
+        patches = [
+            mock.patch("chat.jobs.executor", return_value=InlineExecutor()),
+            # the job runs on the test's connection, which must stay open
+            mock.patch("chat.jobs.close_old_connections"),
+            mock.patch("chat.llm.in_flight", return_value=2),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def post_message(self, **extra):
+        session = self.make_session(2)
+        return session, self.post_json(
+            "/api/chat/message/?version=2", {"message": "hi", "session_id": session.id}, **extra
+        )
+
+    def test_overloaded_turn_becomes_a_job(self):
+        session, resp = self.post_message(HTTP_PREFER="respond-async")
+        self.assertEqual(resp.status_code, 202)
+        data = resp.json()
+        self.assertEqual(resp["Location"], data["poll_url"])
+
+        job = self.client.get(data["poll_url"]).json()
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(job["reply"], STUB_REPLY)
+        self.assertEqual(job["session_id"], session.id)
+        self.assertIn("links", job)
+        self.assertEqual(session.messages.filter(role="assistant").count(), 2)
+
+    def test_failed_job_releases_turn_without_counting_a_reply(self):
+        with mock.patch.object(ReplyJob.objects, "get", side_effect=DatabaseError("boom")):
+            session, resp = self.post_message(HTTP_PREFER="respond-async")
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(ReplyJob.objects.get().status, "failed")
+
+        session.refresh_from_db()
+        self.assertEqual((session.user_message_count, session.bot_message_count), (2, 0))
+        self.assertIsNone(session.turn_lease_until)
+        self.assertEqual(session.messages.filter(role="assistant").count(), 1)
+
+    def test_clients_without_prefer_stay_synchronous(self):
+        _, resp = self.post_message()
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(ReplyJob.objects.exists())
+
+    def test_below_threshold_stays_synchronous(self):
+        with mock.patch("chat.llm.in_flight", return_value=1):
+            _, resp = self.post_message(HTTP_PREFER="respond-async")
+        self.assertEqual(resp.status_code, 200)
+
+    def test_wait_must_be_finite(self):
+        job = ReplyJob.objects.create(session=self.make_session(2))
+        for wait in ("nan", "inf", "-inf", "soon"):
+            with self.subTest(wait=wait):
+                started = time.monotonic()
+                resp = self.client.get(f"/api/chat/jobs/{job.pk}/", {"wait": wait})
+                self.assertEqual(resp.status_code, 400)
+                self.assertLess(time.monotonic() - started, 1)
+
+    def test_stale_job_reports_failed(self):
+        session = self.make_session(2)
+        job = ReplyJob.objects.create(session=session)
+        ReplyJob.objects.filter(pk=job.pk).update(created_at=timezone.now() - timedelta(hours=1))
+        data = self.client.get(f"/api/chat/jobs/{job.pk}/").json()
+        self.assertEqual(data["status"], "failed")
+
+
+class IdempotencyTests(EndpointTestCase):
+    def test_chat_replay_skips_llm_and_storage(self):
+        session = self.make_session(2)
+        body = {"message": "hi", "session_id": session.id}
+        first = self.post_json("/api/chat/message/?version=2", body, HTTP_IDEMPOTENCY_KEY="k1")
+        second = self.post_json("/api/chat/message/?version=2", body, HTTP_IDEMPOTENCY_KEY="k1")
+
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(llm.complete.call_count, 1)
+        self.assertEqual(session.messages.count(), 4)
+
+    def test_lead_replay_sends_one_email(self):
+        for _ in range(3):
+            resp = self.post_json("/api/chat/lead/", {"email": "v@example.com"}, HTTP_IDEMPOTENCY_KEY="k2")
+            self.assertEqual(resp.status_code, 201)
+        self.assertEqual(Lead.objects.count(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_key_reused_for_different_body(self):
+        self.post_json("/api/chat/lead/", {"email": "a@example.com"}, HTTP_IDEMPOTENCY_KEY="k3")
+        resp = self.post_json("/api/chat/lead/", {"email": "b@example.com"}, HTTP_IDEMPOTENCY_KEY="k3")
+        self.assertEqual(resp.status_code, 422)
+
+    def test_duplicate_waits_for_first_attempt(self):
+        body = {"email": "v@example.com"}
+        # First attempt still running: it holds the key but has no response yet.
+        self.post_json("/api/chat/lead/", body, HTTP_IDEMPOTENCY_KEY="k4")
+        record = IdempotencyKey.objects.get(key="k4")
+        stored = (record.status_code, record.response)
+        IdempotencyKey.objects.filter(pk=record.pk).update(status_code=None, response=None)
+
+        def first_attempt_finishes(seconds):
+            IdempotencyKey.objects.filter(pk=record.pk).update(status_code=stored[0], response=stored[1])
+
+        with mock.patch("chat.idempotency.time.sleep", side_effect=first_attempt_finishes) as sleep:
+            resp = self.post_json("/api/chat/lead/", body, HTTP_IDEMPOTENCY_KEY="k4")
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp["Idempotent-Replayed"], "true")
+        self.assertEqual(Lead.objects.count(), 1)
+
+    def test_busy_session_is_not_replayed(self):
+        session = self.make_session(2)
+        body = {"message": "hi", "session_id": session.id}
+        with mock.patch("chat.views.begin_turn", return_value=None):
+            busy = self.post_json("/api/chat/message/?version=2", body, HTTP_IDEMPOTENCY_KEY="k5")
+        self.assertEqual(busy.status_code, 409)
+        self.assertFalse(IdempotencyKey.objects.filter(key="k5").exists())
+
+        retry = self.post_json("/api/chat/message/?version=2", body, HTTP_IDEMPOTENCY_KEY="k5")
+        self.assertEqual(retry.status_code, 200)
+        self.assertNotIn("Idempotent-Replayed", retry)
+        self.assertEqual(llm.complete.call_count, 1)
+
+
+class SessionOrderingTests(TransactionTestCase):
+    """Concurrent turns on one session must run strictly one after another."""
+
+    SESSIONS = 3
+    THREADS_PER_SESSION = 4
+    MESSAGES_PER_THREAD = 5
+
+    def setUp(self):
+        self.bad_histories = []
+        patches = [
+            mock.patch("chat.llm.complete", side_effect=self.fake_llm),
+            mock.patch("chat.views.get_geo_db", return_value=FakeGeoDB()),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def fake_llm(self, history, cache_key=None):
+        # Every call must see the complete, alternating transcript ending in its own question.
+        roles = [m["role"] for m in history[1:]]
+        expected = ["user", "assistant"] * (len(roles) // 2) + ["user"]
+        if roles != expected:
+            self.bad_histories.append(roles)
+        time.sleep(0.005)  # widen the race window
+        return llm.Completion(f"reply to {history[-1]['content']}")
+
+    def chat(self, session_id, prefix, errors):
+        client = Client()
+        try:
+            for i in range(self.MESSAGES_PER_THREAD):
+                resp = client.post(
+                    "/api/chat/message/?version=2",
+                    {"message": f"{prefix}-{i}", "session_id": session_id},
+                    content_type="application/json",
+                )
+                if resp.status_code != 200:
+                    errors.append(resp.status_code)
+        except Exception as e:
+            errors.append(repr(e))
+        finally:
+            connection.close()
+
+    def test_turns_are_serialized_per_session(self):
+        sessions = [ChatSession.objects.create() for _ in range(self.SESSIONS)]
+        errors = []
+        threads = [
+            threading.Thread(target=self.chat, args=(session.id, f"s{session.id}t{t}", errors))
+            for session in sessions
+            for t in range(self.THREADS_PER_SESSION)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(self.bad_histories, [])
+
+        turns = self.THREADS_PER_SESSION * self.MESSAGES_PER_THREAD
+        for session in sessions:
+            session.refresh_from_db()
+            messages = list(session.messages.order_by("created_at", "id").values_list("role", "text"))
+            self.assertEqual(len(messages), 2 * turns)
+            for (user_role, question), (bot_role, answer) in zip(messages[::2], messages[1::2]):
+                self.assertEqual((user_role, bot_role), ("user", "assistant"))
+                self.assertEqual(answer, f"reply to {question}")
+            # No lost counter updates
+            self.assertEqual(session.user_message_count, turns)
+            self.assertEqual(session.bot_message_count, turns)
+            self.assertIsNone(session.turn_lease_until)
+
+
+class FailedTurnTests(EndpointTestCase):
+    def test_lease_released_when_turn_fails(self):
+        session = self.make_session(2)
+        with mock.patch("chat.views.record_fast_path_hit", side_effect=RuntimeError("db down")):
+            with self.assertRaises(RuntimeError):
+                self.post_json("/api/chat/message/", {"message": "pricing", "session_id": session.id})
+        session.refresh_from_db()
+        self.assertIsNone(session.turn_lease_until)
+
+        started = time.monotonic()
+        resp = self.post_json("/api/chat/message/?version=2", {"message": "hi", "session_id": session.id})
+        self.assertEqual(resp.status_code, 200)
+        self.assertLess(time.monotonic() - started, 1)
+
+
+class SocketClient:
+    """Drives chat_socket in-process, like an ASGI server would."""
+
+    def __init__(self, query="", origin=None, drop_after=None):
+        self.events = asyncio.Queue()
+        self.sent = asyncio.Queue()
+        # Frames delivered before the "client" goes away and send() raises.
+        self.drop_after = drop_after
+        headers = [(b"origin", origin.encode())] if origin else []
+        scope = {
+            "type": "websocket",
+            "path": "/ws/chat/",
+            "query_string": query.encode(),
+            "headers": headers,
+            "client": ("8.8.8.8", 50000),
+        }
+        self.task = asyncio.ensure_future(chat_socket(scope, self.events.get, self.send))
+
+    async def send(self, event):
+        if self.drop_after is not None and event["type"] == "websocket.send":
+            if self.drop_after == 0:
+                raise OSError("client disconnected")
+            self.drop_after -= 1
+        await self.sent.put(event)
+
+    async def connect(self):
+        await self.events.put({"type": "websocket.connect"})
+        return await self.next_event()
+
+    async def say(self, text):
+        await self.events.put({"type": "websocket.receive", "text": json.dumps({"message": text})})
+
+    async def next_event(self):
+        return await asyncio.wait_for(self.sent.get(), timeout=10)
+
+    async def next_frame(self, frame_type):
+        """Skip ahead to the next JSON frame of `frame_type`."""
+        while True:
+            event = await self.next_event()
+            frame = json.loads(event["text"])
+            if frame["type"] == frame_type or frame["type"] == "error":
+                return frame
+
+    async def close(self):
+        await self.events.put({"type": "websocket.disconnect"})
+        await asyncio.wait_for(self.task, timeout=10)
+
+
+@override_settings(CHAT_TURN_LEASE_TIMEOUT=1)
+class ChatSocketTests(TransactionTestCase):
+    def setUp(self):
+        self.histories = []
+        patches = [
+            mock.patch("chat.llm.astream", side_effect=self.fake_astream),
+            mock.patch("chat.views.get_geo_db", return_value=FakeGeoDB()),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    async def fake_astream(self, history, cache_key=None, usage=None):
+        self.histories.append([(m["role"], m["content"]) for m in history[1:]])
+        for token in ("Stubbed ", "streamed ", "reply."):
+            await asyncio.sleep(0)
+            yield token
+
+    async def test_new_session_is_bound_and_answered(self):
+        client = SocketClient()
+        self.assertEqual((await client.connect())["type"], "websocket.accept")
+        await client.say("tell me something")
+        frames = [json.loads((await client.next_event())["text"]) for _ in range(5)]
+        await client.close()
+
+        session = await ChatSession.objects.aget()
+        self.assertEqual(frames[0], {"type": "session", "session_id": session.id})
+        self.assertEqual([f["text"] for f in frames[1:4]], ["Stubbed ", "streamed ", "reply."])
+        self.assertEqual(frames[4]["type"], "reply")
+        self.assertEqual(frames[4]["text"], "Stubbed streamed reply.")
+        self.assertEqual((session.user_message_count, session.bot_message_count), (1, 1))
+        self.assertIsNone(session.turn_lease_until)
+        messages = [m async for m in session.messages.order_by("id").values_list("role", "text")]
+        self.assertEqual(messages, [("user", "tell me something"), ("assistant", "Stubbed streamed reply.")])
+
+    async def test_existing_session_is_bound_on_connect(self):
+        session = await ChatSession.objects.acreate()
+        client = SocketClient(f"session_id={session.id}")
+        await client.connect()
+        self.assertEqual(await client.next_frame("session"), {"type": "session", "session_id": session.id})
+        await client.close()
+
+    async def test_other_bots_session_is_not_bound(self):
+        await Bot.objects.acreate(slug="other", name="Other", system_prompt="x")
+        acme = await Bot.objects.acreate(slug="acme", name="Acme", system_prompt="x")
+        session = await ChatSession.objects.acreate(bot=acme)
+        client = SocketClient(f"session_id={session.id}&bot=other")
+        await client.connect()
+        await client.say("hello")
+        frame = await client.next_frame("session")
+        await client.close()
+
+        self.assertNotEqual(frame["session_id"], session.id)
+        self.assertEqual(self.histories, [[("user", "hello")]])
+        self.assertEqual(await session.messages.acount(), 0)
+
+    @override_settings(CORS_ALLOW_ALL_ORIGINS=False, CORS_ALLOWED_ORIGINS=["https://www.dotswitch.space"])
+    async def test_foreign_origin_is_rejected(self):
+        client = SocketClient(origin="https://evil.example")
+        self.assertEqual(await client.connect(), {"type": "websocket.close", "code": 4403})
+        await asyncio.wait_for(client.task, timeout=10)
+
+        client = SocketClient(origin="https://www.dotswitch.space")
+        self.assertEqual((await client.connect())["type"], "websocket.accept")
+        await client.close()
+
+    async def test_disconnect_mid_stream_keeps_partial_reply(self):
+        session = await ChatSession.objects.acreate()
+        # session frame and one token frame, then the client is gone
+        client = SocketClient(f"session_id={session.id}", drop_after=2)
+        await client.connect()
+        await client.say("tell me something")
+        await asyncio.wait_for(client.task, timeout=10)
+
+        reply = await session.messages.filter(role="assistant").aget()
+        self.assertEqual(reply.text, "Stubbed streamed")
+        await session.arefresh_from_db()
+        self.assertIsNone(session.turn_lease_until)
+
+    async def test_busy_session_does_not_stall_other_sockets(self):
+        busy = await ChatSession.objects.acreate(turn_lease_until=timezone.now() + timedelta(hours=1))
+        waiting, fresh = SocketClient(f"session_id={busy.id}"), SocketClient()
+        await waiting.connect()
+        await fresh.connect()
+
+        started = time.monotonic()
+        await waiting.say("is anyone there?")
+        await asyncio.sleep(0.1)  # let it start waiting on the lease
+        await fresh.say("hello")
+        reply = await fresh.next_frame("reply")
+        fresh_elapsed = time.monotonic() - started
+        error = await waiting.next_frame("reply")
+        waiting_elapsed = time.monotonic() - started
+
+        self.assertEqual(reply["text"], "Stubbed streamed reply.")
+        self.assertLess(fresh_elapsed, 1)
+        self.assertEqual(error["type"], "error")
+        self.assertGreaterEqual(waiting_elapsed, 1.5)
+        await waiting.close()
+        await fresh.close()
+
+    async def test_turn_sees_messages_from_other_tabs(self):
+        session = await ChatSession.objects.acreate()
+        await Message.objects.acreate(session=session, role="user", text="first")
+        await Message.objects.acreate(session=session, role="assistant", text="first reply")
+        client = SocketClient(f"session_id={session.id}")
+        await client.connect()
+
+        # Another tab takes a turn after this socket loaded the history.
+        await Message.objects.acreate(session=session, role="user", text="from the other tab")
+        await Message.objects.acreate(session=session, role="assistant", text="other tab reply")
+
+        await client.say("second")
+        await client.next_frame("reply")
+        await client.say("third")
+        await client.next_frame("reply")
+        await client.close()
+
+        self.assertEqual(
+            self.histories[-1],
+            [
+                ("user", "first"), ("assistant", "first reply"),
+                ("user", "from the other tab"), ("assistant", "other tab reply"),
+                ("user", "second"), ("assistant", "Stubbed streamed reply."),
+                ("user", "third"),
+            ],
+        )
+
+    async def test_lease_released_when_turn_fails(self):
+        session = await ChatSession.objects.acreate()
+        client = SocketClient(f"session_id={session.id}")
+        await client.connect()
+        with mock.patch("chat.websocket.record_fast_path_hit", side_effect=RuntimeError("db down")):
+            await client.say("pricing")
+            with self.assertRaises(RuntimeError):
+                await asyncio.wait_for(client.task, timeout=10)
+        await session.arefresh_from_db()
+        self.assertIsNone(session.turn_lease_until)
+
+
+class AdminTests(EndpointTestCase):
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_superuser("admin", "admin@example.com", "pw")
+        self.client.force_login(user)
+
+    def test_changelists_are_constant(self):
+        # 2 auth + [bot filter choices] + row estimate + capped count + one page (FKs joined)
+        urls = {"/admin/chat/chatsession/": 6, "/admin/chat/message/": 5, "/admin/chat/lead/": 6}
+        for n in (1, 30):
+            for _ in range(n):
+                self.make_leads(1, session=self.make_session(2))
+            for url, queries in urls.items():
+                with self.subTest(url=url, sessions=n):
+                    with self.assertNumQueries(queries):
+                        resp = self.client.get(url)
+                    self.assertEqual(resp.status_code, 200)
+
+    def test_big_table_uses_estimate(self):
+        self.make_session(2)
+        with mock.patch("chat.admin.estimated_rows", return_value=5_000_000):
+            resp = self.client.get("/admin/chat/message/")
+        self.assertEqual(resp.context["cl"].result_count, 5_000_000)
+
+    def test_search_ignores_non_numeric_ids(self):
+        resp = self.client.get("/admin/chat/chatsession/?q=not-a-number")
+        self.assertEqual(resp.status_code, 200)
+
+    def test_search_uses_indexes(self):
+        session = self.make_session(4, ip_address="8.8.8.8")
+        other = self.make_session(4, ip_address="1.1.1.1")
+        self.make_leads(2, session=session)
+        searches = [
+            ("/admin/chat/chatsession/", str(session.id), [session.id]),
+            ("/admin/chat/chatsession/", "8.8.8.8", [session.id]),
+            ("/admin/chat/message/", str(other.id), list(other.messages.values_list("id", flat=True))),
+            ("/admin/chat/lead/", "visitor1@example.com", list(Lead.objects.filter(email="visitor1@example.com").values_list("id", flat=True))),
+        ]
+        for url, term, expected in searches:
+            with self.subTest(url=url, term=term):
+                resp = self.client.get(url, {"q": term})
+                queryset = resp.context["cl"].queryset
+                self.assertCountEqual([obj.id for obj in queryset], expected)
+                sql, params = queryset.query.sql_with_params()
+                with connection.cursor() as cursor:
+                    cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+                    plan = " ".join(str(row[-1]) for row in cursor.fetchall())
+                self.assertNotIn("CAST", sql)
+                self.assertNotRegex(plan, r"SCAN chat_\w+($| )")
+
+    def test_transcript_is_paginated(self):
+        session = self.make_session(120)
+        ChatSession.objects.filter(pk=session.pk).update(user_message_count=60, bot_message_count=60)
+        url = f"/admin/chat/chatsession/{session.pk}/change/"
+
+        resp = self.client.get(url)
+        texts = [form.instance.text for form in resp.context["inline_admin_formsets"][0].formset.forms]
+        self.assertEqual(len(texts), 50)
+        self.assertTrue(texts[0].startswith("message 0 "))
+        self.assertEqual(resp.context["transcript_pager"]["pages"], 3)
+
+        resp = self.client.get(url + "?transcript_page=3")
+        texts = [form.instance.text for form in resp.context["inline_admin_formsets"][0].formset.forms]
+        self.assertEqual(len(texts), 20)
+        self.assertTrue(texts[-1].startswith("message 119 "))
+
+
+class ProfilingTests(EndpointTestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.profile_dir = os.path.join(tmp.name, "profiles")
+        overrides = override_settings(
+            PROFILE_DIR=self.profile_dir, PROFILE_TOKEN="s3cret", PROFILE_SAMPLE_RATE=0, PROFILE_INTERVAL_MS=1
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        # Give the sampler something to catch inside the view.
+        slow = mock.patch("chat.llm.complete", side_effect=self.slow_complete)
+        slow.start()
+        self.addCleanup(slow.stop)
+
+    def slow_complete(self, *args, **kwargs):
+        time.sleep(0.03)
+        return llm.Completion(STUB_REPLY)
+
+    def send(self, **extra):
+        return self.post_json("/api/chat/message/?version=2", {"message": "tell me a story"}, **extra)
+
+    def test_off_by_default(self):
+        self.send()
+        self.send(HTTP_X_PROFILE="wrong")
+        self.assertFalse(os.path.exists(self.profile_dir))
+
+    def test_header_writes_collapsed_stacks(self):
+        resp = self.send(HTTP_X_PROFILE="s3cret")
+        self.assertEqual(resp.status_code, 200)
+        [name] = os.listdir(self.profile_dir)
+        self.assertRegex(name, r"^\d+-chat_message-200-\d+ms\.folded$")
+        with open(os.path.join(self.profile_dir, name)) as fh:
+            lines = fh.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.rsplit(" ", 1)[1].isdigit() for line in lines))
+        self.assertTrue(any("chat.views:chat_message;" in line and "slow_complete" in line for line in lines))
+
+    @override_settings(PROFILE_SAMPLE_RATE=1, PROFILE_RING_SIZE=2)
+    def test_ring_keeps_newest(self):
+        for _ in range(3):
+            self.send()
+        names = sorted(os.listdir(self.profile_dir))
+        self.assertEqual(len(names), 2)
+
+    def test_staff_list_and_download(self):
+        self.send(HTTP_X_PROFILE="s3cret")
+        [name] = os.listdir(self.profile_dir)
+
+        resp = self.client.get("/api/chat/profiles/")
+        self.assertEqual(resp.status_code, 302)
+
+        self.login_staff()
+        resp = self.client.get("/api/chat/profiles/")
+        self.assertContains(resp, name)
+        resp = self.client.get(f"/api/chat/profiles/{name}/")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("chat.views:chat_message", b"".join(resp.streaming_content).decode())
+        resp = self.client.get("/api/chat/profiles/..%2Fsettings.py/")
+        self.assertEqual(resp.status_code, 404)
+
+
+class SessionTranscriptTests(EndpointTestCase):
+    def walk(self, session, limit):
+        """All pages of the JSON transcript, asserting each costs the same."""
+        ids, cursor = [], None
+        while True:
+            params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+            # 2 auth, session exists, one page
+            with self.assertNumQueries(4):
+                resp = self.client.get(f"/api/chat/sessions/{session.id}/messages/", params)
+            self.assertEqual(resp.status_code, 200)
+            ids += [m["id"] for m in resp.json()["messages"]]
+            cursor = resp.json()["next_cursor"]
+            if cursor is None:
+                return ids
+
+    def test_json_pages_cover_transcript_in_order(self):
+        self.login_staff()
+        session = self.make_session(120)
+        expected = list(session.messages.order_by("created_at", "id").values_list("id", flat=True))
+        self.assertEqual(self.walk(session, 50), expected)
+
+        # Ties on created_at are broken by id, never skipped or repeated.
+        session.messages.update(created_at=timezone.now())
+        self.assertEqual(self.walk(session, 7), sorted(expected))
+
+    def test_json_requires_staff_and_valid_cursor(self):
+        session = self.make_session(2)
+        url = f"/api/chat/sessions/{session.id}/messages/"
+        self.assertIn(self.client.get(url).status_code, (401, 403))
+        self.login_staff()
+        self.assertEqual(self.client.get(url, {"cursor": "garbage"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/chat/sessions/999999/messages/").status_code, 404)
+
+    def test_detail_page_is_constant(self):
+        self.login_staff()
+        for size in self.SIZES:
+            with self.subTest(messages=size):
+                session = self.make_session(size)
+                # 2 auth, session + bot, one page
+                with self.assertNumQueries(4):
+                    resp = self.client.get(f"/api/chat/sessions/{session.id}/")
+                self.assertEqual(len(resp.context["messages"]), min(size, 50))
+                self.assertEqual(resp.context["next_cursor"] is not None, size > 50)
+
+    def test_lead_email_has_excerpt_and_link(self):
+        session = self.make_session(250)
+        ChatSession.objects.filter(pk=session.pk).update(user_message_count=125, bot_message_count=125)
+        self.post_json("/api/chat/lead/", {"email": "v@example.com", "session_id": session.id})
+        body = mail.outbox[0].body
+        self.assertIn("(last 20 of 250 messages)", body)
+        self.assertIn(f"http://testserver/api/chat/sessions/{session.id}/", body)
+        self.assertIn("message 249 ", body)
+        self.assertNotIn("message 229 ", body)
+
+
+class ReconcileCountersTests(EndpointTestCase):
+    def test_recomputes_drifted_sessions(self):
+        drifted = self.make_session(6)  # user_message_count=3, bot_message_count never written
+        self.make_leads(2, session=drifted)
+        clean = self.make_session(0)
+
+        out = StringIO()
+        call_command("reconcile_counters", "--batch-size", "1", stdout=out)
+        self.assertIn("corrected 1 sessions", out.getvalue())
+
+        drifted.refresh_from_db()
+        self.assertEqual((drifted.user_message_count, drifted.bot_message_count), (3, 3))
+        self.assertEqual((drifted.lead_count, drifted.gated_lead_count), (2, 1))
+        user_messages = drifted.messages.filter(role="user").order_by("created_at")
+        self.assertEqual(drifted.first_message_at, user_messages.first().created_at)
+        self.assertEqual(drifted.last_message_at, user_messages.last().created_at)
+        clean.refresh_from_db()
+        self.assertEqual(clean.user_message_count, 0)
+
+        out = StringIO()
+        call_command("reconcile_counters", stdout=out)
+        self.assertIn("corrected 0 sessions", out.getvalue())
+
+    def test_live_turns_need_no_correction(self):
+        session_id = None
+        for text in ("hi there", "what are your prices?", "tell me about shopify stores"):
+            data = {"message": text} if session_id is None else {"message": text, "session_id": session_id}
+            response = self.post_json("/api/chat/message/?version=2", data)
+            self.assertEqual(response.status_code, 200)
+            session_id = response.json()["session_id"]
+
+        out = StringIO()
+        call_command("reconcile_counters", "--dry-run", stdout=out)
+        self.assertIn("would correct 0 sessions", out.getvalue())
+
+
+class GeoDatasetTests(TestCase):
+    RANGES = [
+        ("start", "end", "country", "region", "city"),  # header row is skipped
+        ("8.8.8.0", "8.8.8.255", "US", "California", "Mountain View"),
+        ("1.1.1.0", "1.1.1.255", "AU", "Queensland", "Brisbane"),
+        ("2001:4860::", "2001:4860:ffff:ffff:ffff:ffff:ffff:ffff", "US", "California", "Mountain View"),
+        ("2400:cb00::", "2400:cb00:ffff:ffff:ffff:ffff:ffff:ffff", "India", "Maharashtra", "Mumbai"),
+    ]
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "ip-geo.bin")
+        overrides = override_settings(GEOIP_DB_PATH=self.path)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.addCleanup(setattr, geo, "_db", None)
+
+    def test_lookup_v4_and_v6(self):
+        self.assertEqual(geo.write_dataset(self.path, self.RANGES), (2, 2))
+        db = geo.GeoDB(self.path)
+        us = {"country": "United States", "region": "California", "city": "Mountain View"}
+        self.assertEqual(db.lookup("8.8.8.8"), us)
+        self.assertEqual(db.lookup("::ffff:8.8.8.8"), us)
+        self.assertEqual(db.lookup("2001:4860:4860::8888"), us)
+        self.assertEqual(db.lookup("1.1.1.1")["country"], "Australia")
+        self.assertEqual(db.lookup("2400:cb00:2048::1")["city"], "Mumbai")
+        self.assertIsNone(db.lookup("9.9.9.9"))
+        self.assertIsNone(db.lookup("2a00:1450::1"))
+        self.assertIsNone(db.lookup("10.0.0.1"))
+        self.assertIsNone(db.lookup("not an ip"))
+
+    def test_reopens_after_refresh(self):
+        self.assertIsNone(geo.get_geo_db())
+        geo.write_dataset(self.path, self.RANGES)
+        first = geo.get_geo_db()
+        self.assertIs(geo.get_geo_db(), first)
+        self.assertIsNone(first.lookup("9.9.9.9"))
+
+        geo.write_dataset(self.path, [*self.RANGES, ("9.9.9.0", "9.9.9.255", "CH", "Zurich", "Zurich")])
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        refreshed = geo.get_geo_db()
+        self.assertIsNot(refreshed, first)
+        self.assertEqual(refreshed.lookup("9.9.9.9")["country"], "Switzerland")
+
+    def test_refresh_geo_command_converts_codes(self):
+        csv_path = os.path.join(os.path.dirname(self.path), "dbip.csv")
+        with open(csv_path, "w") as fh:
+            fh.write("8.8.8.0,8.8.8.255,NA,US,California,Mountain View,37.4,-122.1\n")
+        call_command("refresh_geo", csv_path, stdout=StringIO())
+        self.assertEqual(geo.get_geo_db().lookup("8.8.8.8")["country"], "United States")
+
+
+class BackfillGeoTests(EndpointTestCase):
+    def make_sessions(self):
+        for ip in ("8.8.8.8", "8.8.8.8", "1.1.1.1", "10.0.0.1", "8.8.8.8"):
+            ChatSession.objects.create(ip_address=ip)
+        ChatSession.objects.create(ip_address="9.9.9.9", country="Already", city="Set")
+
+    def ipapi_response(self, url, timeout):
+        ip = url.split("/")[3]
+        resp = mock.Mock(status_code=200)
+        resp.json.return_value = {"country_name": f"Country {ip}", "region": "R", "city": "C"}
+        return resp
+
+    def test_resolves_each_ip_once_online(self):
+        self.make_sessions()
+        with mock.patch("chat.geo.requests.get", side_effect=self.ipapi_response) as get:
+            call_command("backfill_geo", "--online", "--rate", "0", "--chunk-size", "2", stdout=StringIO())
+
+        looked_up = sorted(c.args[0].split("/")[3] for c in get.call_args_list)
+        self.assertEqual(looked_up, ["1.1.1.1", "8.8.8.8"])
+        self.assertEqual(ChatSession.objects.filter(country="Country 8.8.8.8").count(), 3)
+        self.assertEqual(ChatSession.objects.get(ip_address="10.0.0.1").country, "")
+        self.assertEqual(ChatSession.objects.get(ip_address="9.9.9.9").country, "Already")
+
+    def test_uses_offline_dataset_and_resumes(self):
+        self.make_sessions()
+        first = ChatSession.objects.order_by("id")[0]
+        with mock.patch("chat.management.commands.backfill_geo.get_geo_db", return_value=FakeGeoDB()):
+            out = StringIO()
+            call_command("backfill_geo", "--after-id", str(first.id), stdout=out)
+        self.assertIn("Backfilled 3 of 4 sessions", out.getvalue())
+        first.refresh_from_db()
+        self.assertEqual(first.country, "")
+        self.assertEqual(ChatSession.objects.filter(country="India").count(), 3)
+
+
+class LongSessionMemoryTests(EndpointTestCase):
+    """Peak Python allocations for a turn on a very long session."""
+
+    LONG_SESSION = 2000
+
+    def peak_bytes(self, func):
+        tracemalloc.start()
+        try:
+            func()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_chat_message_v2(self):
+        session = self.make_session(self.LONG_SESSION)
+        peak = self.peak_bytes(
+            lambda: self.post_json("/api/chat/message/?version=2", {"message": "hi", "session_id": session.id})
+        )
+        self.assertLess(peak, 4 * 1024 * 1024)
+
+    def test_submit_lead(self):
+        session = self.make_session(self.LONG_SESSION)
+        peak = self.peak_bytes(
+            lambda: self.post_json("/api/chat/lead/", {"email": "v@example.com", "session_id": session.id})
+        )
+        self.assertLess(peak, 4 * 1024 * 1024)
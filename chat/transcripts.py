@@ -0,0 +1,61 @@
+"""
+Reading a session's transcript a page at a time.
+
+Pages are keyed by a (created_at, id) cursor instead of an OFFSET, so page
+500 of a huge session costs the same as page 1: one index range scan on
+chat_msg_session_order, LIMIT page size + 1.
+"""
+
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+from .models import Message
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Lead emails quote at most this many recent messages, each cut to EXCERPT_CHARS.
+EXCERPT_MESSAGES = 20
+EXCERPT_CHARS = 1000
+
+
+def encode_cursor(message):
+    raw = f"{message.created_at.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """(created_at, id) from encode_cursor(); ValueError for anything else."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, message_id = raw.split("|")
+        return datetime.fromisoformat(created_at), int(message_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
+
+
+def transcript_page(session_id, cursor=None, limit=PAGE_SIZE):
+    """
+    Up to `limit` messages after `cursor`, oldest first. Returns
+    (messages, next_cursor); next_cursor is None on the last page.
+    """
+    messages = Message.objects.filter(session_id=session_id).only("id", "role", "text", "created_at")
+    if cursor:
+        created_at, message_id = decode_cursor(cursor)
+        # The redundant created_at >= bound keeps this a single index range.
+        messages = messages.filter(created_at__gte=created_at).filter(
+            Q(created_at__gt=created_at) | Q(id__gt=message_id)
+        )
+    page = list(messages.order_by("created_at", "id")[:limit + 1])
+    if len(page) <= limit:
+        return page, None
+    page = page[:limit]
+    return page, encode_cursor(page[-1])
+
+
+def transcript_excerpt(session_id, limit=EXCERPT_MESSAGES):
+    """The session's last `limit` messages, oldest first."""
+    recent = Message.objects.filter(session_id=session_id).only("role", "text", "created_at")
+    return list(recent.order_by("-created_at", "-id")[:limit])[::-1]
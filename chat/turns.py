@@ -0,0 +1,112 @@
+"""
+Per-session turn ordering.
+
+Two quick messages in one session used to run concurrently: both read the
+history, both asked the LLM with partial context and the replies
+interleaved. A turn now holds a short lease on its ChatSession row
+(turn_lease_until) from the user message until the bot message is stored:
+
+- begin_turn() takes the lease with one conditional UPDATE, which also bumps
+  user_message_count in SQL (no lost counter updates);
+- store_user_message() saves the user message and copies its created_at to
+  the session's first/last_message_at, the same definition
+  reconcile_counters recomputes them with;
+- a second turn on the same session polls until the lease is released, or
+  until it expires (the holder's worker died);
+- end_turn() bumps bot_message_count and releases the lease, but only if
+  it is still ours; release_turn() just releases it, for a turn that failed
+  before storing its reply.
+
+Nothing is held open in the database between those statements (no
+select_for_update transaction across the LLM call), so other sessions are
+not affected and SQLite doesn't serialize everything.
+"""
+
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from .models import ChatSession, Message
+
+# How often a waiting turn re-checks the lease.
+POLL_INTERVAL = 0.05
+
+
+def lease_expiry(now):
+    return now + timedelta(seconds=settings.CHAT_TURN_LEASE_TIMEOUT)
+
+
+def try_begin_turn(session):
+    """
+    One attempt at taking the session's turn lease (and counting the user
+    message). Returns the lease, or None if another turn holds it.
+    """
+    now = timezone.now()
+    lease = lease_expiry(now)
+    taken = ChatSession.objects.filter(
+        Q(turn_lease_until__isnull=True) | Q(turn_lease_until__lt=now),
+        pk=session.pk,
+    ).update(
+        turn_lease_until=lease,
+        user_message_count=F("user_message_count") + 1,
+    )
+    if not taken:
+        return None
+    session.turn_lease_until = lease
+    return lease
+
+
+def store_user_message(session, text):
+    """
+    Save the turn's user message and stamp the session's last_message_at (and
+    first_message_at for a new session) with its created_at.
+    """
+    message = Message.objects.create(session=session, role="user", text=text)
+    stamps = {"last_message_at": message.created_at}
+    if session.first_message_at is None:
+        stamps["first_message_at"] = message.created_at
+    ChatSession.objects.filter(pk=session.pk).update(**stamps)
+    for field, value in stamps.items():
+        setattr(session, field, value)
+    return message
+
+
+def turn_wait_deadline():
+    """monotonic() time after which a waiting turn gives up."""
+    return time.monotonic() + settings.CHAT_TURN_LEASE_TIMEOUT + 1
+
+
+def begin_turn(session):
+    """
+    Take the session's turn lease, waiting for the previous turn. Returns the
+    lease to pass to end_turn(), or None if the previous turn didn't finish
+    in time. Blocks the calling thread; async callers poll try_begin_turn().
+    """
+    deadline = turn_wait_deadline()
+    while True:
+        lease = try_begin_turn(session)
+        if lease is not None:
+            return lease
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(POLL_INTERVAL)
+
+
+def end_turn(session_id, lease):
+    """Count the bot message and release the lease (unless it expired and was taken over)."""
+    ChatSession.objects.filter(pk=session_id).update(
+        bot_message_count=F("bot_message_count") + 1,
+        turn_lease_until=Case(
+            When(turn_lease_until=lease, then=Value(None)),
+            default=F("turn_lease_until"),
+        ),
+    )
+
+
+
+def release_turn(session_id, lease):
+    """Give the lease back without a bot message (the turn failed part-way)."""
+    ChatSession.objects.filter(pk=session_id, turn_lease_until=lease).update(turn_lease_until=None)
@@ -1,10 +1,19 @@
 from django.urls import path
-from .views import chat_message, submit_lead, chat_stats, chatbot_dashboard, lead_list
+from .views import (
+    chat_message, reply_job, submit_lead, chat_stats, chatbot_dashboard, lead_list, transcript_search,
+    session_detail, session_messages, profile_list, profile_download,
+)
 
 urlpatterns = [
     path('message/', chat_message, name='chat_message'),
+    path('jobs/<uuid:job_id>/', reply_job, name='chat_reply_job'),
     path('lead/', submit_lead, name='submit_lead'),
     path('stats/', chat_stats, name='chat_stats'),
     path('dashboard/', chatbot_dashboard, name='chatbot_dashboard'),
     path('leads-view/', lead_list, name='chat_lead_list'),
+    path('search/', transcript_search, name='chat_transcript_search'),
+    path('sessions/<int:session_id>/', session_detail, name='chat_session_detail'),
+    path('sessions/<int:session_id>/messages/', session_messages, name='chat_session_messages'),
+    path('profiles/', profile_list, name='chat_profile_list'),
+    path('profiles/<str:name>/', profile_download, name='chat_profile_download'),
 ]
@@ -1,23 +1,33 @@
-import os
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework import status
-from .models import ChatSession, Message, Lead
-from .serializers import ChatSessionSerializer
+from .models import Bot, ChatSession, Message, Lead, ReplyJob
+from .serializers import ChatSessionSerializer, MessageSerializer
 from django.views.decorators.csrf import csrf_exempt
 from django.core.mail import send_mail
 from django.conf import settings
-from openai import OpenAI
-import requests
 from django.utils import timezone
 from django.db.models import Count, Sum, Max, Min
-from django.shortcuts import render
+from django.shortcuts import get_object_or_404, render
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404
 from django.db.models.functions import TruncDate
 from datetime import timedelta
-
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from django.urls import reverse
+import math
+import time
+from . import jobs, llm
+from .fastpath import record_hit as record_fast_path_hit
+from .geo import get_geo_db, ipapi_lookup, public_address
+from .idempotency import idempotent
+from .profiling import list_profiles, profile_path, profiled
+from .routers import analytics_view
+from .search import search_transcripts
+from .tenants import BotProfile, get_bot_profile
+from .transcripts import EXCERPT_CHARS, MAX_PAGE_SIZE, PAGE_SIZE, transcript_excerpt, transcript_page
+from .turns import begin_turn, end_turn, lease_expiry, release_turn, store_user_message
 
 
 SYSTEM_PROMPT = """
@@ -166,44 +176,157 @@ KNOWLEDGE_LINKS = [
     },
 ]
 
-def get_relevant_links(user_message: str):
-    """
-    Very simple keyword-based matcher to surface up to 3 relevant links
-    based on the latest user message.
-    """
-    if not user_message:
-        return []
+CONTACT_KEYWORDS = [
+    "talk to you",
+    "talk to someone",
+    "reach out",
+    "contact you",
+    "speak to",
+    "schedule a call",
+    "book a call",
+    "jump on a call",
+    "ai fashion",
+    "lookbook",
+    "rate card",
+    "portfolio",
+    "contact",
+    "pdf",
+    "quote",
+    "proposal",
+    "gtm audit",
+    "free audit",
+    "marketing audit",
+    "scope",
+    "custom plan",
+]
 
-    text = user_message.lower()
-    matches = []
+# Plain questions whose answer is fixed KB text; answered without OpenAI
+# (see fastpath.py). Gated links / lead prompts still come from reply_extras.
+FAST_ANSWERS = [
+    {
+        "name": "pricing",
+        "keywords": ["pricing", "price", "prices", "cost", "costs", "rates", "charges", "how much", "budget", "plans"],
+        "reply": (
+            "Pricing at Dotswitch is scope-based: we understand your use case and create a custom plan. "
+            "Typical monthly marketing budgets range from ₹20,000 to ₹2,00,000, and there's a free audit "
+            "+ pricing discussion when you reach out."
+        ),
+        "lead": "contact",
+    },
+    {
+        "name": "portfolio",
+        "keywords": ["portfolio", "work samples", "case studies", "capabilities deck", "deck", "showreel", "your work"],
+        "reply": (
+            "Happy to share our portfolio! It covers our CX, webstore, content and performance marketing "
+            "work for D2C brands and B2B SaaS."
+        ),
+        "gated": ["Dotswitch Portfolio (PDF)"],
+    },
+    {
+        "name": "contact",
+        "keywords": [
+            "contact", "contact you", "talk to someone", "talk to you", "reach out", "speak to someone",
+            "book a call", "schedule a call", "call", "email", "phone", "get in touch",
+        ],
+        "reply": (
+            "You can reach the Dotswitch team right here. Share your email and Sid will get in touch "
+            "personally to understand what you need."
+        ),
+        "lead": "contact",
+    },
+]
 
-    for entry in KNOWLEDGE_LINKS:
-        if any(kw in text for kw in entry["keywords"]):
-            matches.append({"label": entry["label"], "url": entry["url"]})
+# The built-in Dotswitch bot: used for sessions/leads that have no Bot row.
+DEFAULT_BOT_PROFILE = BotProfile(
+    name="Dotswitch",
+    system_prompt=SYSTEM_PROMPT,
+    knowledge_links=KNOWLEDGE_LINKS,
+    gated_resources=GATED_RESOURCES,
+    contact_keywords=CONTACT_KEYWORDS,
+    contact_prompt=(
+        "It sounds like you'd like to talk to the Dotswitch team or discuss a custom plan. "
+        "Share your email and I'll have Sid reach out personally."
+    ),
+    gated_prompt=(
+        "I can share our detailed PDF for this. "
+        "Drop your name and email so I can unlock the link for you."
+    ),
+    fast_answers=FAST_ANSWERS,
+)
+
+
+def profile_for(bot):
+    """Compiled prompt/matchers for a bot (None = the built-in Dotswitch bot)."""
+    if bot is None:
+        return DEFAULT_BOT_PROFILE
+    return get_bot_profile(bot)
+
+
+def resolve_bot(slug):
+    """Bot for a widget-supplied slug; None (built-in bot) when no slug is given."""
+    if not slug:
+        return None
+    return Bot.objects.get(slug=slug, is_active=True)
+
+
+def find_session(session_id, bot_slug):
+    """
+    The session a widget wants to continue, or None if there's no such session
+    or it belongs to a different bot than the widget names (one tenant's
+    widget must never continue another tenant's conversation).
+    """
+    if not session_id:
+        return None
+    try:
+        session = ChatSession.objects.select_related("bot").get(id=session_id)
+    except (ChatSession.DoesNotExist, ValueError):
+        return None
+    if bot_slug and (session.bot is None or session.bot.slug != bot_slug):
+        return None
+    return session
 
-    # If no match but they mention dotswitch in general, suggest a couple of core links
-    if not matches and "dotswitch" in text:
-        matches.append(
-            {"label": "GTM Biz Consulting", "url": "https://www.dotswitch.space/gtm-biz-consult"}
-        )
-        matches.append(
-            {"label": "CX Web Design", "url": "https://www.dotswitch.space/cx-design-for-web"}
-        )
 
-    # Limit to 3 buttons to keep UI clean
-    return matches[:3]  
+def start_session(ip, user_agent, bot=None):
+    """
+    Create the session for a visitor's first message and geo-tag it. The
+    session starts out holding its first turn's lease (session.turn_lease_until).
+    """
+    now = timezone.now()
+    session = ChatSession.objects.create(
+        bot=bot,
+        ip_address=ip,
+        user_agent=user_agent,
+        user_message_count=1,  # we'll count the current user message immediately
+        turn_lease_until=lease_expiry(now),
+    )
+    # Geo-lookup (non-blocking best-effort)
+    enrich_session_geo(session, session.ip_address)
+    return session
 
 
+@profiled("chat_message")
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@idempotent("chat_message")
 def chat_message(request):
     """
     Request body:
     {
       "session_id": 1 (optional),
+      "bot": "client-slug" (optional; default Dotswitch bot -- a session_id
+             of a different bot starts a new session),
       "message": "User's question"
     }
+
+    Response (default, v1): session_id, the full "messages" transcript, links,
+    gated_links, needs_lead_for_links, lead_suggestion.
+    Response with ?version=2: the same, but "reply" (the new bot text) in
+    place of the transcript.
+
+    Send an Idempotency-Key header to make retries safe (see idempotency.py).
+    Send "Prefer: respond-async" to accept a 202 + job id when the server is
+    overloaded (see jobs.py).
     """
     session_id = request.data.get("session_id")
     user_message = request.data.get("message")
@@ -212,78 +335,90 @@ def chat_message(request):
         return Response({"error": "message is required"}, status=status.HTTP_400_BAD_REQUEST)
 
     # 1. Get or create session
-    if session_id:
-        try:
-            session = ChatSession.objects.get(id=session_id)
-        except ChatSession.DoesNotExist:
-            session = None
-    else:
-        session = None
+    session = find_session(session_id, request.data.get("bot"))
 
     if session is None:
-        # New session: capture IP, UA, and first_message_at
-        ip = get_client_ip(request)
-        ua = request.META.get("HTTP_USER_AGENT", "")
-
-        session = ChatSession.objects.create(
-            ip_address=ip,
-            user_agent=ua,
-            first_message_at=timezone.now(),
-            last_message_at=timezone.now(),
-            user_message_count=1,  # we'll count the current user message immediately
+        try:
+            bot = resolve_bot(request.data.get("bot"))
+        except Bot.DoesNotExist:
+            return Response({"error": "unknown bot"}, status=status.HTTP_400_BAD_REQUEST)
+        # New session: capture IP and UA
+        session = start_session(
+            get_client_ip(request),
+            request.META.get("HTTP_USER_AGENT", ""),
+            bot=bot,
         )
-        # Geo-lookup (non-blocking best-effort)
-        enrich_session_geo(session, session.ip_address)
+        lease = session.turn_lease_until
     else:
-        # Existing session: increment counters & timestamps
-        session.user_message_count += 1
-        session.last_message_at = timezone.now()
-        session.save(update_fields=["user_message_count", "last_message_at"])
-
-    # 2. Save user message
-    Message.objects.create(session=session, role='user', text=user_message)
-
-    # 3. Build conversation history for the model
-    history = [{"role": "system", "content": SYSTEM_PROMPT}]
-    for m in session.messages.order_by('created_at'):
-        history.append({"role": m.role, "content": m.text})
+        # Existing session: wait for any turn still being answered, then
+        # increment counters
+        lease = begin_turn(session)
+        if lease is None:
+            return Response(
+                {"error": "the previous message is still being answered"},
+                status=status.HTTP_409_CONFLICT,
+            )
 
-    # 4. Call OpenAI
+    # Anything below that fails before the turn is handed off or ended must
+    # still release the lease, or the session's next message waits it out.
     try:
-        completion = client.chat.completions.create(
-            model="gpt-5-nano",
-            messages=history,
-        )
-        bot_reply = completion.choices[0].message.content
-    except Exception as e:
-        print("OpenAI error:", e)  # debug
-        bot_reply = "I ran into an issue fetching an answer. Please try again in a moment."
-
-    # 5. Save bot message
-    Message.objects.create(session=session, role='assistant', text=bot_reply)
-
-    # 6. Determine relevant links for this user message
-    links = get_relevant_links(user_message)
-
-    # 7. Determine gated links (PDFs, etc.)
-    gated_links = get_gated_links(user_message)
-    needs_lead_for_links = bool(gated_links)
-
-    # 8. Determine if we should prompt for contact even without gated links
-    lead_suggestion = None
-
-    if needs_lead_for_links:
-        lead_suggestion = (
-            "I can share our detailed PDF for this. "
-            "Drop your name and email so I can unlock the link for you."
-        )
-    elif looks_like_contact_intent(user_message):
-        lead_suggestion = (
-            "It sounds like you'd like to talk to the Dotswitch team or discuss a custom plan. "
-            "Share your email and I'll have Sid reach out personally."
-        )
+        # 2. Save user message (and stamp first/last_message_at with it)
+        store_user_message(session, user_message)
+
+        profile = profile_for(session.bot)
+        fast = profile.fast_answer(user_message)
+        if fast is not None:
+            # 3-4. Plain KB question: templated answer, no history read or OpenAI call
+            bot_reply = fast.reply
+            extras = fast.extras
+            usage = {}
+            record_fast_path_hit(session.bot, fast.rule)
+        else:
+            # 3. Build conversation history for the model (static prompt first, see
+            # BotProfile.history; the id tie-break keeps the order byte-stable)
+            history = profile.history(
+                session.messages.order_by('created_at', 'id').values_list('role', 'text')
+            )
 
-    # 7. Return updated session with messages + links
+            # Links, gated links (PDFs, etc.) and lead prompt for this message
+            extras = profile.reply_extras(user_message)
+
+            # OpenAI is backed up: answer 202 now and let the client poll for the reply
+            if jobs.wants_async(request):
+                job = jobs.enqueue(session, history, profile.cache_key, extras, lease)
+                lease = None  # the job ends the turn
+                poll_url = reverse("chat_reply_job", args=[job.id])
+                return Response(
+                    {"session_id": session.id, "job_id": job.id, "status": job.status, "poll_url": poll_url},
+                    status=status.HTTP_202_ACCEPTED,
+                    headers={"Location": poll_url},
+                )
+
+            # 4. Call OpenAI
+            try:
+                completion = llm.complete(history, cache_key=profile.cache_key)
+                bot_reply = completion.text
+                usage = completion.usage
+            except Exception as e:
+                print("OpenAI error:", e)  # debug
+                bot_reply = "I ran into an issue fetching an answer. Please try again in a moment."
+                usage = {}
+
+        # 5. Save bot message and let the session's next turn run
+        Message.objects.create(session=session, role='assistant', text=bot_reply, **usage)
+        end_turn(session.id, lease)
+        lease = None
+    finally:
+        if lease is not None:
+            release_turn(session.id, lease)
+
+    # v2 (?version=2): just the new reply -- the client already has the rest
+    # of the transcript, so the payload stays the same size as the chat grows.
+    if request.version == "2":
+        data = {"session_id": session.id, "reply": bot_reply, **extras}
+        return Response(data, status=status.HTTP_200_OK)
+
+    # v1: return updated session with messages + links
     data = {
         "session_id": session.id,
         "messages": [
@@ -294,27 +429,67 @@ def chat_message(request):
             }
             for m in session.messages.order_by('created_at')
         ],
-        "links": links,
-        "gated_links": gated_links,
-        "needs_lead_for_links": needs_lead_for_links,
-        "lead_suggestion": lead_suggestion,
+        **extras,
     }
     return Response(data, status=status.HTTP_200_OK)
 
 
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def reply_job(request, job_id):
+    """
+    Poll an async reply job from chat_message. ?wait=N long-polls up to N
+    seconds (capped at CHAT_JOB_MAX_WAIT) for it to finish.
+
+    Response: job_id, session_id, status ("pending" / "done" / "failed") and,
+    once finished, the v2 reply fields (reply, links, gated_links, ...).
+    """
+    try:
+        wait = float(request.GET.get("wait", 0))
+    except ValueError:
+        wait = math.nan
+    # nan/inf would slip through min/max and make the deadline unreachable
+    if not math.isfinite(wait):
+        return Response({"error": "wait must be a number of seconds"}, status=status.HTTP_400_BAD_REQUEST)
+    wait = min(max(wait, 0), settings.CHAT_JOB_MAX_WAIT)
+    deadline = time.monotonic() + wait
+
+    while True:
+        try:
+            job = ReplyJob.objects.get(pk=job_id)
+        except ReplyJob.DoesNotExist:
+            return Response({"error": "unknown job"}, status=status.HTTP_404_NOT_FOUND)
+        state = jobs.job_state(job)
+        if state != "pending" or time.monotonic() >= deadline:
+            break
+        time.sleep(jobs.POLL_INTERVAL)
+
+    data = {"job_id": job.id, "session_id": job.session_id, "status": state}
+    if state == "done":
+        data.update(reply=job.reply, **job.extras)
+    elif state == "failed":
+        data["reply"] = jobs.LLM_ERROR_REPLY
+    return Response(data, status=status.HTTP_200_OK)
+
+
+@profiled("submit_lead")
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@idempotent("submit_lead")
 def submit_lead(request):
     """
     Request body:
     {
       "session_id": 1,
+      "bot": "client-slug",              # a session of another bot is ignored
       "name": "Visitor Name",
       "email": "visitor@example.com",
       "lead_type": "contact",            # or "gated_info" later
       "message": "I want to discuss..."  # optional
     }
+
+    Send an Idempotency-Key header so a retried submission doesn't email twice.
     """
     data = request.data
     email = data.get("email")
@@ -325,17 +500,22 @@ def submit_lead(request):
     if not email:
         return Response({"error": "email is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-    session = None
-    session_id = data.get("session_id")
-    if session_id:
+    session = find_session(data.get("session_id"), data.get("bot"))
+
+    # Leads belong to their session's bot
+    if session:
+        bot = session.bot
+    else:
         try:
-            session = ChatSession.objects.get(id=session_id)
-        except ChatSession.DoesNotExist:
-            session = None
+            bot = resolve_bot(data.get("bot"))
+        except Bot.DoesNotExist:
+            return Response({"error": "unknown bot"}, status=status.HTTP_400_BAD_REQUEST)
+    profile = profile_for(bot)
 
     # Create lead record
     lead = Lead.objects.create(
         session=session,
+        bot=bot,
         name=name,
         email=email,
         lead_type=lead_type,
@@ -349,18 +529,25 @@ def submit_lead(request):
             session.gated_lead_count += 1
         session.save(update_fields=["lead_count", "gated_lead_count"])
 
-    # Build chat transcript (if session exists)
+    # Recent part of the chat transcript (if session exists); the full one is a link away
     transcript_lines = []
     if session:
-        for m in session.messages.order_by("created_at"):
-            label = "User" if m.role == "user" else "Dotswitch Bot"
-            transcript_lines.append(f"{label}: {m.text}")
+        for m in transcript_excerpt(session.id):
+            label = "User" if m.role == "user" else f"{profile.name} Bot"
+            text = m.text if len(m.text) <= EXCERPT_CHARS else m.text[:EXCERPT_CHARS] + "…"
+            transcript_lines.append(f"{label}: {text}")
     transcript = "\n".join(transcript_lines) if transcript_lines else "(no transcript available)"
+    if session:
+        total = session.user_message_count + session.bot_message_count
+        if total > len(transcript_lines):
+            transcript = f"(last {len(transcript_lines)} of {total} messages)\n\n{transcript}"
+        transcript_url = request.build_absolute_uri(reverse("chat_session_detail", args=[session.id]))
+        transcript += f"\n\nFull transcript: {transcript_url}"
 
     # Compose email
-    subject = f"[Dotswitch Chatbot Lead] {lead.email} ({lead.lead_type})"
+    subject = f"[{profile.name} Chatbot Lead] {lead.email} ({lead.lead_type})"
     body = f"""
-New chatbot lead from Dotswitch website.
+New chatbot lead from {profile.name} website.
 
 Name: {lead.name or "(not provided)"}
 Email: {lead.email}
@@ -372,7 +559,7 @@ Free-text message: {lead.message or "(none)"}
 {transcript}
 """.strip()
 
-    to_email = getattr(settings, "LEAD_NOTIFICATION_EMAIL", None)
+    to_email = profile.lead_notification_email or getattr(settings, "LEAD_NOTIFICATION_EMAIL", None)
     from_email = getattr(settings, "DEFAULT_FROM_EMAIL", "crew@dotswitch.space")
 
     if to_email:
@@ -396,51 +583,20 @@ Free-text message: {lead.message or "(none)"}
         status=status.HTTP_201_CREATED,
     )
 
-def get_gated_links(user_message: str):
-    """Return a list of gated links based on the user message."""
-    if not user_message:
-        return []
-
-    text = user_message.lower()
-    matches = []
-
-    for entry in GATED_RESOURCES:
-        if any(kw in text for kw in entry["keywords"]):
-            matches.append({"label": entry["label"], "url": entry["url"]})
-
-    return matches
+def bot_scoped(request):
+    """
+    Session and lead querysets for the analytics views, narrowed by ?bot=<slug>
+    ("default" = the built-in Dotswitch bot). No parameter = all bots.
+    """
+    slug = request.GET.get("bot")
+    if not slug:
+        scope = {}
+    elif slug == "default":
+        scope = {"bot__isnull": True}
+    else:
+        scope = {"bot__slug": slug}
+    return ChatSession.objects.filter(**scope), Lead.objects.filter(**scope)
 
-def looks_like_contact_intent(user_message: str) -> bool:
-    """Heuristic: does this sound like 'talk to human / pricing / audit' intent?"""
-    if not user_message:
-        return False
-
-    text = user_message.lower()
-    contact_keywords = [
-        "talk to you",
-        "talk to someone",
-        "reach out",
-        "contact you",
-        "speak to",
-        "schedule a call",
-        "book a call",
-        "jump on a call",
-        "ai fashion",
-        "lookbook",
-        "rate card",
-        "portfolio",
-        "contact",
-        "pdf",
-        "quote",
-        "proposal",
-        "gtm audit",
-        "free audit",
-        "marketing audit",
-        "scope",
-        "custom plan",
-    ]
-
-    return any(kw in text for kw in contact_keywords)
 
 def get_client_ip(request):
     """Best-effort extraction of client IP (works behind proxies too)."""
@@ -454,25 +610,36 @@ def get_client_ip(request):
 
 
 def enrich_session_geo(session, ip):
-    """Call external geo API once per session (skip local IPs)."""
+    """
+    Geo-tag a session once (skip local IPs). Uses the offline dataset from
+    `manage.py refresh_geo` when present; otherwise falls back to ipapi.co.
+    """
     if not ip:
         return
 
-    # Local/private IPs – don't bother geolocating
-    private_prefixes = ("127.", "10.", "192.168.", "172.16.")
-    if ip.startswith(private_prefixes):
+    # Local/private/reserved IPs – don't bother geolocating
+    if public_address(ip) is None:
         session.ip_address = ip
         session.save(update_fields=["ip_address"])
         return
 
+    geo_db = get_geo_db()
+    if geo_db is not None:
+        location = geo_db.lookup(ip) or {}
+        session.ip_address = ip
+        session.country = location.get("country", "")
+        session.region = location.get("region", "")
+        session.city = location.get("city", "")
+        session.save(update_fields=["ip_address", "country", "region", "city"])
+        return
+
     try:
-        resp = requests.get(f"https://ipapi.co/{ip}/json/", timeout=2)
-        if resp.status_code == 200:
-            data = resp.json()
+        location = ipapi_lookup(ip)
+        if location is not None:
             session.ip_address = ip
-            session.country = data.get("country_name") or ""
-            session.region = data.get("region") or ""
-            session.city = data.get("city") or ""
+            session.country = location["country"]
+            session.region = location["region"]
+            session.city = location["city"]
             session.save(update_fields=["ip_address", "country", "region", "city"])
         else:
             session.ip_address = ip
@@ -483,24 +650,34 @@ def enrich_session_geo(session, ip):
         session.save(update_fields=["ip_address"])
 
 @api_view(['GET'])
-@permission_classes([AllowAny])  # NOTE: in prod, lock this down!
+@permission_classes([IsAdminUser])  # covers every tenant's sessions, so staff only
+@analytics_view
 def chat_stats(request):
-    total_sessions = ChatSession.objects.count()
-    total_leads = Lead.objects.count()
-    total_gated_leads = Lead.objects.filter(lead_type="gated_info").count()
+    """Headline counters as JSON (staff only). Supports ?version=2 for a compact payload."""
+    sessions, leads = bot_scoped(request)
+
+    total_sessions = sessions.count()
+    total_leads = leads.count()
+    total_gated_leads = leads.filter(lead_type="gated_info").count()
 
-    totals = ChatSession.objects.aggregate(
+    totals = sessions.aggregate(
         total_user_msgs=Sum("user_message_count"),
         total_bot_msgs=Sum("bot_message_count"),
     )
 
-    sessions_by_country = list(
-        ChatSession.objects
+    by_country = (
+        sessions
         .values("country")
         .annotate(count=Count("id"))
         .order_by("-count")
     )
 
+    # v2 (?version=2): [country, count] pairs instead of one dict per country
+    if request.version == "2":
+        sessions_by_country = list(by_country.values_list("country", "count"))
+    else:
+        sessions_by_country = list(by_country)
+
     return Response(
         {
             "total_sessions": total_sessions,
@@ -513,15 +690,19 @@ def chat_stats(request):
         status=status.HTTP_200_OK,
     )
 
+@profiled("chatbot_dashboard")
 @login_required
+@analytics_view
 def chatbot_dashboard(request):
     """HTML dashboard with high-level metrics and charts."""
+    sessions, leads = bot_scoped(request)
+
     # Totals
-    total_sessions = ChatSession.objects.count()
-    total_leads = Lead.objects.count()
-    total_gated_leads = Lead.objects.filter(lead_type="gated_info").count()
+    total_sessions = sessions.count()
+    total_leads = leads.count()
+    total_gated_leads = leads.filter(lead_type="gated_info").count()
 
-    totals = ChatSession.objects.aggregate(
+    totals = sessions.aggregate(
         total_user_msgs=Sum("user_message_count"),
         total_bot_msgs=Sum("bot_message_count"),
     )
@@ -540,7 +721,7 @@ def chatbot_dashboard(request):
 
     # Sessions per day
     daily_sessions_qs = (
-        ChatSession.objects.filter(created_at__date__gte=start_date)
+        sessions.filter(created_at__date__gte=start_date)
         .annotate(day=TruncDate("created_at"))
         .values("day")
         .annotate(count=Count("id"))
@@ -549,7 +730,7 @@ def chatbot_dashboard(request):
 
     # Leads per day
     daily_leads_qs = (
-        Lead.objects.filter(created_at__date__gte=start_date)
+        leads.filter(created_at__date__gte=start_date)
         .annotate(day=TruncDate("created_at"))
         .values("day")
         .annotate(count=Count("id"))
@@ -572,13 +753,13 @@ def chatbot_dashboard(request):
 
     # Sessions by country
     sessions_by_country = (
-        ChatSession.objects.values("country")
+        sessions.values("country")
         .annotate(count=Count("id"))
         .order_by("-count")
     )
 
     # Recent sessions
-    recent_sessions = ChatSession.objects.order_by("-created_at")[:20]
+    recent_sessions = sessions.order_by("-created_at")[:20]
 
     context = {
         "total_sessions": total_sessions,
@@ -596,16 +777,19 @@ def chatbot_dashboard(request):
     return render(request, "chat/dashboard.html", context)
 
 @login_required
+@analytics_view
 def lead_list(request):
     """HTML table of leads (recent first)."""
+    _, all_leads = bot_scoped(request)
+
     leads = (
-        Lead.objects.select_related("session")
+        all_leads.select_related("session")
         .order_by("-created_at")[:200]
     )
 
     # Unique emails summary (basic)
     unique_emails = (
-        Lead.objects.values("email")
+        all_leads.values("email")
         .annotate(
             first_seen=Min("created_at"),
             last_seen=Max("created_at"),
@@ -619,3 +803,83 @@ def lead_list(request):
         "unique_emails": unique_emails,
     }
     return render(request, "chat/leads.html", context)
+
+@login_required
+@analytics_view
+def transcript_search(request):
+    """HTML full-text search over chat transcripts, ranked and paginated by session."""
+    query = request.GET.get("q", "").strip()
+    try:
+        page = max(1, int(request.GET.get("page", 1)))
+    except ValueError:
+        page = 1
+
+    results, has_next = search_transcripts(query, page=page) if query else ([], False)
+
+    context = {
+        "query": query,
+        "results": results,
+        "page": page,
+        "has_next": has_next,
+        "has_previous": page > 1,
+    }
+    return render(request, "chat/search.html", context)
+
+@staff_member_required
+def session_detail(request, session_id):
+    """Staff drill-down into one session: its counters and one page of transcript."""
+    session = get_object_or_404(ChatSession.objects.select_related("bot"), id=session_id)
+    cursor = request.GET.get("cursor") or None
+    try:
+        messages, next_cursor = transcript_page(session.id, cursor)
+    except ValueError:
+        raise Http404("Invalid cursor")
+
+    context = {
+        "session": session,
+        "messages": messages,
+        "next_cursor": next_cursor,
+        "is_first_page": cursor is None,
+    }
+    return render(request, "chat/session_detail.html", context)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def session_messages(request, session_id):
+    """
+    One page of a session's transcript, oldest first:
+    GET /api/chat/sessions/<id>/messages/?cursor=<next_cursor>&limit=50
+    """
+    if not ChatSession.objects.filter(id=session_id).exists():
+        return Response({"error": "session not found"}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        limit = min(max(1, int(request.query_params.get("limit", PAGE_SIZE))), MAX_PAGE_SIZE)
+        messages, next_cursor = transcript_page(session_id, request.query_params.get("cursor"), limit)
+    except ValueError:
+        return Response({"error": "invalid cursor or limit"}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(
+        {
+            "session_id": session_id,
+            "messages": MessageSerializer(messages, many=True).data,
+            "next_cursor": next_cursor,
+        },
+        status=status.HTTP_200_OK,
+    )
+
+@staff_member_required
+def profile_list(request):
+    """Staff-only list of the sampled request profiles in PROFILE_DIR."""
+    context = {
+        "profiles": list_profiles(),
+        "ring_size": settings.PROFILE_RING_SIZE,
+    }
+    return render(request, "chat/profiles.html", context)
+
+@staff_member_required
+def profile_download(request, name):
+    """One profile's collapsed stacks as a text download."""
+    path = profile_path(name)
+    if path is None:
+        raise Http404("No such profile")
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=name, content_type="text/plain")
@@ -0,0 +1,272 @@
+"""
+WebSocket chat transport (raw ASGI, no Channels).
+
+The widget connects once to /ws/chat/?session_id=<id>&bot=<slug> and then
+exchanges JSON frames over the same socket, so a chat turn skips the CORS
+preflight, the middleware stack and the per-request session lookup / history
+reload.
+
+Client -> server:
+    {"message": "User's question"}
+
+Server -> client:
+    {"type": "session", "session_id": 1}           # once, when a session is bound
+    {"type": "token", "text": "partial "}          # streamed reply chunks (LLM replies only)
+    {"type": "reply", "session_id": 1, "text": "...", "links": [...],
+     "gated_links": [...], "needs_lead_for_links": false, "lead_suggestion": null}
+    {"type": "error", "error": "message is required"}
+
+Leads are still submitted over HTTP (/api/chat/lead/).
+"""
+
+import asyncio
+import functools
+import json
+import time
+from contextlib import aclosing
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import fastpath, llm
+from .models import Bot, Message
+from .turns import (
+    POLL_INTERVAL,
+    end_turn,
+    release_turn,
+    store_user_message,
+    try_begin_turn,
+    turn_wait_deadline,
+)
+from .views import find_session, profile_for, resolve_bot, start_session
+
+CHAT_SOCKET_PATH = "/ws/chat/"
+
+LLM_ERROR_REPLY = "I ran into an issue fetching an answer. Please try again in a moment."
+
+
+def origin_allowed(headers):
+    """Apply the same origin policy as django-cors-headers does for HTTP."""
+    if settings.CORS_ALLOW_ALL_ORIGINS:
+        return True
+    origin = headers.get("origin")
+    # Non-browser clients (benchmarks, server-side callers) send no Origin.
+    return origin is None or origin in getattr(settings, "CORS_ALLOWED_ORIGINS", [])
+
+
+def client_ip(scope, headers):
+    """Same rules as views.get_client_ip, but for an ASGI scope."""
+    x_forwarded_for = headers.get("x-forwarded-for")
+    if x_forwarded_for:
+        return x_forwarded_for.split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else None
+
+
+def db_async(func):
+    """
+    Run an ORM helper in the default thread pool. sync_to_async's default
+    thread-sensitive mode would put every socket in the process on one
+    thread (this raw ASGI handler has no ThreadSensitiveContext), so one
+    slow call would stall them all. Stale connections are closed around each
+    call, as Django does around a request.
+    """
+
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(run, thread_sensitive=False)
+
+
+@db_async
+def load_session(session_id, bot_slug):
+    """
+    Return (session, bot, history, last_message_id). For an unknown/missing
+    session, or one of a different bot (see views.find_session), session is
+    None and bot comes from the slug (raises Bot.DoesNotExist if invalid).
+    """
+    session = find_session(session_id, bot_slug)
+    bot = session.bot if session else resolve_bot(bot_slug)
+    rows = list(session.messages.order_by("created_at", "id").values_list("id", "role", "text")) if session else []
+    history = profile_for(bot).history((role, text) for _, role, text in rows)
+    return session, bot, history, rows[-1][0] if rows else 0
+
+
+@db_async
+def open_session(bot, ip, user_agent):
+    """New session for a first message; its turn lease is already held."""
+    session = start_session(ip, user_agent, bot=bot)
+    return session, session.turn_lease_until
+
+
+try_begin_turn_async = db_async(try_begin_turn)
+
+
+async def begin_turn_async(session):
+    """
+    turns.begin_turn() for the socket: wait for a turn in flight (over HTTP
+    or another socket) with asyncio.sleep, so no thread is held meanwhile.
+    Returns the lease, or None if the session stayed busy.
+    """
+    deadline = turn_wait_deadline()
+    while True:
+        lease = await try_begin_turn_async(session)
+        if lease is not None:
+            return lease
+        if time.monotonic() >= deadline:
+            return None
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+@db_async
+def record_user_message(session, text, last_message_id):
+    """
+    Store the message and return every (id, role, text) after
+    last_message_id, this one included: turns taken by other tabs or over
+    HTTP since the socket last looked, which its in-memory history lacks.
+    """
+    store_user_message(session, text)
+    return list(
+        session.messages.filter(id__gt=last_message_id)
+        .order_by("created_at", "id")
+        .values_list("id", "role", "text")
+    )
+
+
+@db_async
+def record_bot_message(session, text, lease, usage):
+    message = Message.objects.create(session=session, role="assistant", text=text, **usage)
+    end_turn(session.id, lease)
+    return message.id
+
+
+release_turn_async = db_async(release_turn)
+record_fast_path_hit = db_async(fastpath.record_hit)
+
+
+async def send_json(send, payload):
+    await send({"type": "websocket.send", "text": json.dumps(payload)})
+
+
+async def chat_socket(scope, receive, send):
+    """ASGI handler for one chat WebSocket connection."""
+    headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+
+    event = await receive()
+    if event["type"] != "websocket.connect":
+        return
+    if not origin_allowed(headers):
+        await send({"type": "websocket.close", "code": 4403})
+        return
+    await send({"type": "websocket.accept"})
+
+    query = parse_qs(scope.get("query_string", b"").decode())
+    try:
+        session, bot, history, last_message_id = await load_session(
+            (query.get("session_id") or [None])[0],
+            (query.get("bot") or [None])[0],
+        )
+    except Bot.DoesNotExist:
+        await send_json(send, {"type": "error", "error": "unknown bot"})
+        await send({"type": "websocket.close", "code": 4400})
+        return
+    profile = profile_for(bot)
+    if session is not None:
+        await send_json(send, {"type": "session", "session_id": session.id})
+
+    ip = client_ip(scope, headers)
+    user_agent = headers.get("user-agent", "")
+
+    while True:
+        event = await receive()
+        if event["type"] == "websocket.disconnect":
+            return
+        if event["type"] != "websocket.receive":
+            continue
+
+        try:
+            payload = json.loads(event.get("text") or "{}")
+        except ValueError:
+            payload = {}
+        user_message = payload.get("message") if isinstance(payload, dict) else None
+        if not user_message:
+            await send_json(send, {"type": "error", "error": "message is required"})
+            continue
+
+        is_new = disconnected = False
+        if session is None:
+            session, lease = await open_session(bot, ip, user_agent)
+            is_new = True
+        else:
+            lease = await begin_turn_async(session)
+            if lease is None:
+                await send_json(send, {"type": "error", "error": "the previous message is still being answered"})
+                continue
+        # As in views.chat_message: a turn that fails before storing its
+        # reply must still give the lease back.
+        try:
+            if is_new:
+                await send_json(send, {"type": "session", "session_id": session.id})
+            new_rows = await record_user_message(session, user_message, last_message_id)
+            history.extend({"role": role, "content": text} for _, role, text in new_rows)
+            last_message_id = new_rows[-1][0]
+
+            fast = profile.fast_answer(user_message)
+            if fast is not None:
+                # Templated KB answer: no token frames, just the reply.
+                bot_reply = fast.reply
+                extras = fast.extras
+                usage = {}
+                await record_fast_path_hit(bot, fast.rule)
+            else:
+                # History stays in memory for the life of the socket; only the
+                # messages it hasn't seen are read each turn.
+                parts = []
+                usage = {}
+                try:
+                    async with aclosing(llm.astream(history, cache_key=profile.cache_key, usage=usage)) as tokens:
+                        async for token in tokens:
+                            parts.append(token)
+                            try:
+                                await send_json(send, {"type": "token", "text": token})
+                            except OSError:
+                                # Client went away mid-reply (ASGI servers raise an
+                                # OSError on send): stop the stream, keep what we have.
+                                disconnected = True
+                                break
+                    bot_reply = "".join(parts).strip()
+                except Exception as e:
+                    print("OpenAI error:", e)
+                    bot_reply = LLM_ERROR_REPLY
+                    usage = {}
+                extras = profile.reply_extras(user_message)
+
+            last_message_id = await record_bot_message(session, bot_reply, lease, usage)
+            lease = None
+        finally:
+            if lease is not None:
+                await release_turn_async(session.id, lease)
+
+        history.append({"role": "assistant", "content": bot_reply})
+        if disconnected:
+            return
+
+        try:
+            await send_json(
+                send,
+                {
+                    "type": "reply",
+                    "session_id": session.id,
+                    "text": bot_reply,
+                    **extras,
+                },
+            )
+        except OSError:
+            return
@@ -2,6 +2,15 @@
 ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP goes to Django as usual; WebSocket connections on /ws/chat/ go to the
+chat socket handler in ``chat.websocket``.
+
+Serve it with the same gunicorn profile and an ASGI worker:
+
+    gunicorn config.asgi:application -c gunicorn.conf.py -k uvicorn_worker.UvicornWorker
+
+The Procfile still serves config.wsgi, so the widget only uses the socket
+once USE_SOCKET is turned on in dummy.html.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +22,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up, since it pulls in models.
+from chat.websocket import CHAT_SOCKET_PATH, chat_socket  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "websocket":
+        if scope["path"] == CHAT_SOCKET_PATH:
+            await chat_socket(scope, receive, send)
+        else:
+            await receive()
+            await send({"type": "websocket.close", "code": 4404})
+        return
+    await django_application(scope, receive, send)
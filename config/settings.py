@@ -14,12 +14,72 @@ from pathlib import Path
 import os
 from dotenv import load_dotenv
 import dj_database_url
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 load_dotenv(BASE_DIR / '.env')
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-5-nano")
+
+# Hard deadline (seconds) for one OpenAI attempt, and how many retries we allow.
+# gunicorn.conf.py sizes its worker timeouts from these, so keep them in sync.
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "1"))
+# Worst case for one complete() call: every attempt hitting its deadline.
+LLM_DEADLINE = OPENAI_TIMEOUT * (OPENAI_MAX_RETRIES + 1)
+
+# Load testing: when set, skip OpenAI entirely and sleep this many seconds
+# before returning a canned reply (simulates an I/O-bound LLM wait).
+OPENAI_STUB_DELAY = os.getenv("OPENAI_STUB_DELAY")
+
+# Offline IP geolocation: compiled by `manage.py refresh_geo` from GEOIP_DATASET_URL
+# (DB-IP "IP to City Lite" CSV by default). Without it we fall back to ipapi.co.
+GEOIP_DB_PATH = os.getenv("GEOIP_DB_PATH", str(BASE_DIR / "data" / "ip-geo.bin"))
+GEOIP_DATASET_URL = os.getenv("GEOIP_DATASET_URL")
+
+# How many tenants' compiled bot profiles (prompt + matchers) each worker keeps.
+BOT_PROFILE_CACHE_SIZE = int(os.getenv("BOT_PROFILE_CACHE_SIZE", "128"))
+
+# Fast path (chat/fastpath.py): answer plain "pricing"/"portfolio"/"contact"
+# messages from templated KB text without calling OpenAI. A rule must cover at
+# least FAST_PATH_MIN_CONFIDENCE of the message's meaningful words.
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "True") == "True"
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv("FAST_PATH_MIN_CONFIDENCE", "0.75"))
+
+# Async reply jobs (chat/jobs.py). Clients that send "Prefer: respond-async"
+# get 202 + a job id instead of a held connection once this process has
+# CHAT_ASYNC_THRESHOLD OpenAI calls in flight (0 = always). Jobs run on a
+# per-process pool of CHAT_JOB_WORKERS threads; GET /api/chat/jobs/<id>/?wait=N
+# long-polls for at most CHAT_JOB_MAX_WAIT seconds.
+CHAT_ASYNC_THRESHOLD = int(os.getenv("CHAT_ASYNC_THRESHOLD", "12"))
+CHAT_JOB_WORKERS = int(os.getenv("CHAT_JOB_WORKERS", "8"))
+CHAT_JOB_MAX_WAIT = float(os.getenv("CHAT_JOB_MAX_WAIT", "20"))
+
+# Per-session turn lease (chat/turns.py): a turn still running after this long
+# is assumed dead and the session's next message may proceed.
+CHAT_TURN_LEASE_TIMEOUT = float(os.getenv("CHAT_TURN_LEASE_TIMEOUT", LLM_DEADLINE + 10))
+
+# Idempotency-Key support on chat/lead POSTs (chat/idempotency.py): how long a
+# stored response can be replayed, and how long a duplicate waits on the first
+# attempt before assuming its worker died. A live chat turn can first wait out
+# the previous turn's lease (CHAT_TURN_LEASE_TIMEOUT + 1) and then make the
+# worst-case LLM call, so the default covers both; keep it above that if set.
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", "3600"))
+IDEMPOTENCY_LOCK_TIMEOUT = float(
+    os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", CHAT_TURN_LEASE_TIMEOUT + 1 + LLM_DEADLINE + 10)
+)
+
+# On-demand sampling profiler (chat/profiling.py) for chat/lead/dashboard
+# requests: a request is profiled when it sends `X-Profile: <PROFILE_TOKEN>`
+# or with probability PROFILE_SAMPLE_RATE. Collapsed stacks go to PROFILE_DIR,
+# which keeps the newest PROFILE_RING_SIZE files. Off by default.
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", str(BASE_DIR / "data" / "profiles"))
+PROFILE_RING_SIZE = int(os.getenv("PROFILE_RING_SIZE", "200"))
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -73,13 +133,21 @@ if not CORS_ALLOW_ALL_ORIGINS:
         "CORS_ALLOWED_ORIGINS",
     ).split(",")
 
+# The widget sends Idempotency-Key on its POSTs and Prefer for async replies.
+CORS_ALLOW_HEADERS = (*default_headers, "idempotency-key", "prefer")
+
 CSRF_TRUSTED_ORIGINS = os.getenv(
     "DJANGO_CSRF_TRUSTED_ORIGINS",
     "http://127.0.0.1:8000"
 ).split(",")
 
 REST_FRAMEWORK = {
-    "DEFAULT_RENDERER_CLASSES": ["rest_framework.renderers.JSONRenderer"],
+    # orjson-backed when installed, stock JSONRenderer otherwise
+    "DEFAULT_RENDERER_CLASSES": ["chat.renderers.FastJSONRenderer"],
+    # ?version=2 selects the compact chat/stats payloads; v1 stays the default
+    "DEFAULT_VERSIONING_CLASS": "rest_framework.versioning.QueryParameterVersioning",
+    "DEFAULT_VERSION": "1",
+    "ALLOWED_VERSIONS": ["1", "2"],
 }
 
 
@@ -113,6 +181,25 @@ DATABASES = {
     )
 }
 
+# SQLite's default in-memory test DB fails concurrent writers with "table is
+# locked", which breaks the threaded tests (chat.tests.SessionOrderingTests).
+if DATABASES["default"]["ENGINE"] == "django.db.backends.sqlite3":
+    DATABASES["default"]["TEST"] = {"NAME": str(BASE_DIR / "test_db.sqlite3")}
+
+# Optional read replica for dashboard/stats aggregates (see chat/routers.py).
+# Locally you can point it at a copy of the SQLite file:
+#   cp db.sqlite3 analytics.sqlite3
+#   ANALYTICS_DATABASE_URL=sqlite:///analytics.sqlite3
+if os.getenv("ANALYTICS_DATABASE_URL"):
+    DATABASES["analytics"] = dj_database_url.parse(
+        os.getenv("ANALYTICS_DATABASE_URL"),
+        conn_max_age=600,
+    )
+    # In tests, read the default test DB instead of creating a second one.
+    DATABASES["analytics"]["TEST"] = {"MIRROR": "default"}
+
+DATABASE_ROUTERS = ["chat.routers.AnalyticsRouter"]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -0,0 +1,56 @@
+"""
+Gunicorn serving profile for the chatbot.
+
+A chat turn spends nearly all of its time waiting on OpenAI, so sync workers
+(one request per process) leave the dyno idle while capping concurrency at the
+worker count. We run threaded workers instead: each process serves `threads`
+requests at once, which is what an I/O-bound LLM wait needs.
+
+Every knob can be overridden from the environment. To compare against the old
+setup locally:
+
+    OPENAI_STUB_DELAY=1 GUNICORN_WORKER_CLASS=sync GUNICORN_THREADS=1 gunicorn config.wsgi:application -c gunicorn.conf.py
+    OPENAI_STUB_DELAY=1 gunicorn config.wsgi:application -c gunicorn.conf.py
+    python manage.py loadtest --requests 64 --concurrency 32
+
+(gunicorn silently upgrades "sync" to gthread whenever threads > 1, hence
+GUNICORN_THREADS=1 for the baseline.) With 2 workers and a 1s stub, 64 turns
+at concurrency 32 took ~34s on sync workers and ~4.5s on gthread.
+
+Note each thread can hold its own DB connection (CONN_MAX_AGE), so
+workers * threads must stay under the database's connection limit.
+"""
+
+import os
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# Heroku sets WEB_CONCURRENCY from the dyno size.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = _env_int("WEB_CONCURRENCY", 2)
+threads = _env_int("GUNICORN_THREADS", 16)
+
+# On gthread workers `timeout` is only a heartbeat: the worker's main loop
+# notifies the arbiter about once a second while threads serve requests, so a
+# slow LLM call never trips it. (It does bound each request on sync workers,
+# e.g. the baseline above, hence still sized from the worst-case LLM call.)
+# What matters for gthread is graceful_timeout: on a restart or max_requests
+# recycle, in-flight turns get that long to finish before the worker is killed.
+_llm_deadline = float(os.getenv("OPENAI_TIMEOUT", "30")) * (_env_int("OPENAI_MAX_RETRIES", 1) + 1)
+timeout = _env_int("GUNICORN_TIMEOUT", int(_llm_deadline) + 15)
+graceful_timeout = _env_int("GUNICORN_GRACEFUL_TIMEOUT", int(_llm_deadline) + 5)
+keepalive = _env_int("GUNICORN_KEEPALIVE", 5)
+
+# Recycle workers periodically so slow leaks (SDK clients, caches) can't build up.
+# The jitter stops all workers restarting at the same moment.
+max_requests = _env_int("GUNICORN_MAX_REQUESTS", 1000)
+max_requests_jitter = _env_int("GUNICORN_MAX_REQUESTS_JITTER", 100)
+
+accesslog = "-"
+errorlog = "-"